@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pqxdh import Person, SignalStyleSession
+
+# asyncio front-end for pqxdh.py.
+#
+# The KEM operations are CPU-bound and take milliseconds, so they run on an
+# executor instead of the event loop. An Offloader caps how many calls are in
+# flight (callers beyond that wait, which is the back-pressure) and how many may
+# wait; a cancelled caller stops waiting at once, and its slot is freed when
+# the work it started actually finishes.
+
+# Session messages below this size are encrypted inline: it takes microseconds,
+# less than a round trip through the executor
+INLINE_MESSAGE_SIZE = 64 * 1024
+
+class Offloader:
+    """Run blocking calls on an executor with a bounded number in flight"""
+    def __init__(self, executor=None, max_in_flight=None, max_waiting=None):
+        self.executor = executor or ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        self.max_in_flight = max_in_flight or 2 * (os.cpu_count() or 1)
+        # None lets any number of callers queue up; otherwise extra callers get RuntimeError
+        self.max_waiting = max_waiting
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._waiting = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    async def run(self, fn, *args):
+        """Await fn(*args) on the executor"""
+        if self.max_waiting is not None and self._slots.locked() and self._waiting >= self.max_waiting:
+            self.rejected += 1
+            raise RuntimeError("Too many calls waiting for the executor")
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Released when the call really ends, even if the awaiting task was
+        # cancelled while it was running on a worker
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        self.completed += 1
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+class AsyncPerson:
+    """Person with awaitable KEM operations"""
+    def __init__(self, person, offloader):
+        self.person = person
+        self.offloader = offloader
+
+    async def generate_keypair_async(self):
+        return await self.offloader.run(self.person.generate_keypair)
+
+    async def encapsulate_async(self, recipient_public_key):
+        return await self.offloader.run(self.person.encapsulate, recipient_public_key)
+
+    async def decapsulate_async(self, ciphertext):
+        return await self.offloader.run(self.person.decapsulate, ciphertext)
+
+class AsyncSession:
+    """SignalStyleSession with awaitable encrypt/decrypt and attachment streams"""
+    def __init__(self, session, offloader):
+        self.session = session
+        self.offloader = offloader
+
+    async def encrypt_message_async(self, message, recipient_session):
+        if len(message) < INLINE_MESSAGE_SIZE:
+            return self.session.encrypt_message(message, recipient_session)
+        return await self.offloader.run(self.session.encrypt_message, message, recipient_session)
+
+    async def decrypt_message_async(self, encrypted_data):
+        if len(encrypted_data['ciphertext']) < INLINE_MESSAGE_SIZE:
+            return self.session.decrypt_message(encrypted_data)
+        return await self.offloader.run(self.session.decrypt_message, encrypted_data)
+
+    async def _offload_stream(self, chunks):
+        # Each chunk is produced on the executor; the generator is only ever
+        # advanced by one call at a time
+        while True:
+            chunk = await self.offloader.run(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def encrypt_stream_async(self, source, chunk_size=SignalStyleSession.STREAM_CHUNK_SIZE):
+        """Async iterator over encrypt_stream(source) with the reads and encryption off the loop"""
+        return self._offload_stream(self.session.encrypt_stream(source, chunk_size))
+
+    def decrypt_stream_async(self, source):
+        """Async iterator over decrypt_stream(source) with the reads and decryption off the loop"""
+        return self._offload_stream(self.session.decrypt_stream(source))
+
+async def _monitor_loop_lag(samples, interval=0.005):
+    """Record how late the loop wakes up from short sleeps"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+async def _client(server, offloader, messages):
+    """One simulated client: full KEM handshake with the server, then a few messages"""
+    client = AsyncPerson(Person("Client"), offloader)
+    ciphertext = await client.encapsulate_async(server.person.public_key)
+    # The server Person is shared by every client, so use the returned secret
+    # rather than its shared_secret attribute, which the last call overwrites
+    server_secret = await server.decapsulate_async(ciphertext)
+    sending, receiving = SignalStyleSession(client.person), SignalStyleSession(server.person)
+    sending.current_sending_key = client.person.shared_secret
+    receiving.current_receiving_key = server_secret
+    sending, receiving = AsyncSession(sending, offloader), AsyncSession(receiving, offloader)
+    for i in range(messages):
+        encrypted = await sending.encrypt_message_async(f"message {i}", receiving.session)
+        await receiving.decrypt_message_async(encrypted)
+
+async def load_test(clients=32, handshakes=256, messages=10, max_in_flight=None, executor=None):
+    """Drive handshakes from clients concurrent simulated clients; returns throughput and loop lag"""
+    offloader = Offloader(executor, max_in_flight)
+    server = AsyncPerson(Person("Server"), offloader)
+    await server.generate_keypair_async()
+    lag = []
+    monitor = asyncio.create_task(_monitor_loop_lag(lag))
+    remaining = handshakes
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await _client(server, offloader, messages)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    offloader.shutdown()
+    lag.sort()
+    return {
+        'handshakes_per_sec': handshakes / elapsed,
+        'messages_per_sec': handshakes * messages / elapsed,
+        'loop_lag_p50_ms': lag[len(lag) // 2] * 1000 if lag else 0.0,
+        'loop_lag_p99_ms': lag[min(len(lag) - 1, int(len(lag) * 0.99))] * 1000 if lag else 0.0,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent PQXDH handshake load generator")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent simulated clients")
+    parser.add_argument("--handshakes", type=int, default=256, help="total handshakes to run")
+    parser.add_argument("--messages", type=int, default=10, help="messages per handshake")
+    parser.add_argument("--max-in-flight", type=int, help="executor calls allowed at once")
+    args = parser.parse_args()
+
+    result = asyncio.run(load_test(args.clients, args.handshakes, args.messages, args.max_in_flight))
+    print(f"{args.clients} clients, {args.handshakes} handshakes")
+    print(f"Handshakes/sec: {result['handshakes_per_sec']:.1f}")
+    print(f"Messages/sec:   {result['messages_per_sec']:.1f}")
+    print(f"Loop lag p50:   {result['loop_lag_p50_ms']:.3f} ms")
+    print(f"Loop lag p99:   {result['loop_lag_p99_ms']:.3f} ms")
@@ -0,0 +1,656 @@
+import argparse
+import asyncio
+import atexit
+import collections
+import functools
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import async_pqxdh
+import dh
+import diagnostics
+import double_rachet
+import instrumentation
+import pqxdh_handshake
+import prekey_server
+import ring
+import sampling
+import serialize
+import session_store
+from pqxdh import Person, KyberParameters, SignalStyleSession
+from test import Kyber
+from prekey_pool import PrekeyPool
+
+# Benchmark suite for the pqxdh directory.
+#
+# Every case is registered with @benchmark and is a factory that does its
+# setup and returns a zero-argument callable; the runner times each call
+# separately and reports ops/sec with p50/p99 latency. Results can be written
+# as JSON and compared against an earlier run to spot regressions:
+#
+#   python benchmark.py --json before.json
+#   python benchmark.py --json after.json --compare before.json
+
+BENCHMARKS = {}
+
+MESSAGE_SIZES = [16, 256, 4096, 65536]
+
+# RFC 3526 group 14 (2048-bit MODP), a realistic size for the classical DH path
+MODP_2048_P = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+    "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+    "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+    "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+    "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+    "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+MODP_2048_G = 2
+
+def benchmark(name, items=1, max_rounds=None):
+    """Register a benchmark case; items is the number of operations per call"""
+    def register(factory):
+        BENCHMARKS[name] = {'factory': factory, 'items': items, 'max_rounds': max_rounds}
+        return factory
+    return register
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+def measure(op, rounds, items=1, warmup=2):
+    """Time rounds calls of op and summarize the per-call latency"""
+    for _ in range(warmup):
+        op()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        op()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    return {
+        'rounds': rounds,
+        'items': items,
+        'ops_per_sec': items / mean,
+        'mean_ms': mean * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+def run(names, rounds):
+    """Run the named cases, yielding (name, result) as each one finishes"""
+    for name in names:
+        case = BENCHMARKS[name]
+        case_rounds = min(rounds, case['max_rounds'] or rounds)
+        op = case['factory']()
+        result = measure(op, case_rounds, case['items'])
+        yield name, result
+
+def environment():
+    """Metadata stored next to the results so runs can be told apart"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+# --- Kyber KEM in pqxdh.py -------------------------------------------------
+
+def _handshake_pair(backend_name=None):
+    params = KyberParameters()
+    alice = Person("Alice", params, ring.get_backend(params, backend_name))
+    bob = Person("Bob", params, ring.get_backend(params, backend_name))
+    return alice, bob
+
+@benchmark("person.generate_keypair")
+def _person_generate_keypair():
+    _, bob = _handshake_pair()
+    return bob.generate_keypair
+
+@benchmark("person.encapsulate")
+def _person_encapsulate():
+    alice, bob = _handshake_pair()
+    public_key = bob.generate_keypair()
+    return lambda: alice.encapsulate(public_key)
+
+@benchmark("person.decapsulate")
+def _person_decapsulate():
+    alice, bob = _handshake_pair()
+    ciphertext = alice.encapsulate(bob.generate_keypair())
+    return lambda: bob.decapsulate(ciphertext)
+
+def _register_handshake(backend_name, max_rounds=None):
+    @benchmark(f"person.handshake[{backend_name}]", max_rounds=max_rounds)
+    def _handshake():
+        alice, bob = _handshake_pair(backend_name)
+
+        def handshake():
+            ciphertext = alice.encapsulate(bob.generate_keypair())
+            bob.decapsulate(ciphertext)
+        return handshake
+
+_register_handshake(ring.NTTBackend.name)
+_register_handshake(ring.ConvolutionBackend.name)
+# The pure-Python baseline takes hundreds of milliseconds per handshake
+_register_handshake(ring.SchoolbookBackend.name, max_rounds=3)
+
+@benchmark("person.handshake[instrumented]")
+def _handshake_instrumented():
+    # Compare with person.handshake[ntt], which runs with instrumentation disabled
+    alice, bob = _handshake_pair()
+    sink = instrumentation.HistogramSink()
+
+    def handshake():
+        with instrumentation.instrumented(sink):
+            ciphertext = alice.encapsulate(bob.generate_keypair())
+            bob.decapsulate(ciphertext)
+    return handshake
+
+LOGGED_HANDSHAKES = 20
+
+def _register_logged_handshake(mode):
+    # DEBUG records for every handshake written to a file, inline or from the
+    # queue listener thread; compare with person.handshake[ntt] (logging off)
+    @benchmark(f"person.handshake[log={mode}]", items=LOGGED_HANDSHAKES)
+    def _handshake_logged():
+        alice, bob = _handshake_pair()
+        logger = logging.getLogger(diagnostics.ROOT)
+
+        def handshakes():
+            with open(os.devnull, "w") as devnull:
+                handler = logging.StreamHandler(devnull)
+                if mode == "async":
+                    diagnostics.enable_async_logging(handler, level=logging.DEBUG)
+                else:
+                    logger.addHandler(handler)
+                    logger.setLevel(logging.DEBUG)
+                try:
+                    for _ in range(LOGGED_HANDSHAKES):
+                        ciphertext = alice.encapsulate(bob.generate_keypair())
+                        bob.decapsulate(ciphertext)
+                finally:
+                    if mode == "async":
+                        diagnostics.disable_async_logging()
+                    else:
+                        logger.removeHandler(handler)
+                        logger.setLevel(logging.NOTSET)
+        return handshakes
+
+_register_logged_handshake("sync")
+_register_logged_handshake("async")
+
+@benchmark("params.gen_a[uncached]")
+def _gen_a_uncached():
+    params = KyberParameters()
+    seeds = (i.to_bytes(32, "big") for i in itertools.count())
+    sampling.matrix_cache.clear()
+    return lambda: params.gen_a(next(seeds))
+
+@benchmark("params.gen_a[cached]")
+def _gen_a_cached():
+    params = KyberParameters()
+    seed = bytes(32)
+    params.gen_a(seed)
+    return lambda: params.gen_a(seed)
+
+# --- Wire format -------------------------------------------------------------
+
+def _wire_sample():
+    alice, bob = _handshake_pair()
+    seed, t = bob.generate_keypair()
+    c1, c2 = alice.encapsulate((seed, t))
+    return bob.params, seed, t, c1, c2
+
+@benchmark("serialize.encode_public_key")
+def _encode_public_key():
+    _, seed, t, _, _ = _wire_sample()
+    return lambda: serialize.encode_public_key(t, seed)
+
+@benchmark("serialize.decode_public_key")
+def _decode_public_key():
+    params, seed, t, _, _ = _wire_sample()
+    data = serialize.encode_public_key(t, seed)
+    return lambda: serialize.decode_public_key(data, params.k)
+
+@benchmark("serialize.encode_ciphertext")
+def _encode_ciphertext():
+    params, _, _, c1, c2 = _wire_sample()
+    return lambda: serialize.encode_ciphertext(c1, c2, params.du, params.dv)
+
+@benchmark("serialize.decode_ciphertext")
+def _decode_ciphertext():
+    params, _, _, c1, c2 = _wire_sample()
+    data = serialize.encode_ciphertext(c1, c2, params.du, params.dv)
+    return lambda: serialize.decode_ciphertext(data, params.k, params.du, params.dv)
+
+# --- Kyber KEM in test.py ----------------------------------------------------
+
+BATCH_SIZE = 100
+
+@benchmark("kyber.keygen")
+def _kyber_keygen():
+    return Kyber().keygen
+
+@benchmark("kyber.encaps")
+def _kyber_encaps():
+    kyber = Kyber()
+    public_key, _ = kyber.keygen()
+    return lambda: kyber.encaps(public_key)
+
+@benchmark("kyber.decaps")
+def _kyber_decaps():
+    kyber = Kyber()
+    public_key, secret_key = kyber.keygen()
+    ciphertext, _ = kyber.encaps(public_key)
+    return lambda: kyber.decaps(ciphertext, secret_key)
+
+@benchmark(f"kyber.keygen_batch[{BATCH_SIZE}]", items=BATCH_SIZE, max_rounds=10)
+def _kyber_keygen_batch():
+    kyber = Kyber()
+    return lambda: kyber.keygen_batch(BATCH_SIZE)
+
+@benchmark(f"kyber.encaps_batch[{BATCH_SIZE}]", items=BATCH_SIZE, max_rounds=10)
+def _kyber_encaps_batch():
+    kyber = Kyber()
+    public_keys, _ = kyber.keygen_batch(BATCH_SIZE)
+    return lambda: kyber.encaps_batch(public_keys)
+
+@benchmark(f"kyber.decaps_batch[{BATCH_SIZE}]", items=BATCH_SIZE, max_rounds=10)
+def _kyber_decaps_batch():
+    kyber = Kyber()
+    public_key, secret_key = kyber.keygen()
+    ciphertexts, _ = kyber.encaps_batch([public_key] * BATCH_SIZE)
+    return lambda: kyber.decaps_batch(ciphertexts, secret_key)
+
+def _register_prekey_pool(workers, count=500):
+    @benchmark(f"prekey_pool.fill[workers={workers}]", items=count, max_rounds=3)
+    def _prekey_pool_fill():
+        def fill():
+            with PrekeyPool(workers=workers, capacity=count, low_water=0) as pool:
+                pool.get_many(count)
+        return fill
+
+# Fill rate from 1 worker up to one per core
+_cpus = os.cpu_count() or 1
+for _workers in sorted({2 ** i for i in range(_cpus.bit_length())} | {_cpus}):
+    _register_prekey_pool(_workers)
+
+# --- Classical DH in dh.py ---------------------------------------------------
+
+@benchmark("dh.generate_shared_secret[modp2048]")
+def _dh_generate_shared_secret():
+    alice = dh.Person("Alice", MODP_2048_P, MODP_2048_G)
+    bob = dh.Person("Bob", MODP_2048_P, MODP_2048_G)
+    return lambda: alice.generate_shared_secret(bob.public_key)
+
+# --- Session AEAD in pqxdh.py ------------------------------------------------
+
+def _session_pair():
+    alice, bob = _handshake_pair()
+    bob.decapsulate(alice.encapsulate(bob.generate_keypair()))
+    alice_session = SignalStyleSession(alice)
+    bob_session = SignalStyleSession(bob)
+    alice_session.current_sending_key = alice.shared_secret
+    bob_session.current_receiving_key = bob.shared_secret
+    return alice_session, bob_session
+
+def _register_session(size):
+    message = "x" * size
+
+    @benchmark(f"session.encrypt_message[{size}B]")
+    def _encrypt():
+        alice_session, bob_session = _session_pair()
+        return lambda: alice_session.encrypt_message(message, bob_session)
+
+    @benchmark(f"session.decrypt_message[{size}B]")
+    def _decrypt():
+        alice_session, bob_session = _session_pair()
+        encrypted = alice_session.encrypt_message(message, bob_session)
+        return lambda: bob_session.decrypt_message(encrypted)
+
+for _size in MESSAGE_SIZES:
+    _register_session(_size)
+
+STREAM_MIB = 16
+
+def _register_stream(direction):
+    # items are MiB, so ops/s reads as MiB/s
+    @benchmark(f"session.{direction}_stream[{STREAM_MIB}MiB]", items=STREAM_MIB, max_rounds=10)
+    def _stream():
+        alice_session, bob_session = _session_pair()
+        attachment = bytes(STREAM_MIB * 1024 * 1024)
+        if direction == "encrypt":
+            return lambda: collections.deque(alice_session.encrypt_stream(io.BytesIO(attachment)), maxlen=0)
+        encrypted = b"".join(alice_session.encrypt_stream(io.BytesIO(attachment)))
+        return lambda: collections.deque(bob_session.decrypt_stream(io.BytesIO(encrypted)), maxlen=0)
+
+_register_stream("encrypt")
+_register_stream("decrypt")
+
+CHAT_MESSAGES = 1000
+
+@benchmark(f"session.chat[{CHAT_MESSAGES}x16-256B]", items=CHAT_MESSAGES, max_rounds=20)
+def _session_chat():
+    # Typical chat traffic: short messages encrypted by one side and decrypted by the other
+    alice_session, bob_session = _session_pair()
+    messages = ["x" * (16 + i % 241) for i in range(CHAT_MESSAGES)]
+
+    def chat():
+        for message in messages:
+            bob_session.decrypt_message(alice_session.encrypt_message(message, bob_session))
+    return chat
+
+# --- asyncio front-end in async_pqxdh.py ---------------------------------------
+
+ASYNC_HANDSHAKES = 64
+
+def _register_async(clients):
+    @benchmark(f"async.handshake[clients={clients}]", items=ASYNC_HANDSHAKES, max_rounds=5)
+    def _async_handshakes():
+        return lambda: asyncio.run(async_pqxdh.load_test(clients, ASYNC_HANDSHAKES, messages=0))
+
+for _clients in (1, 32):
+    _register_async(_clients)
+
+# --- PQXDH and X3DH in pqxdh_handshake.py ------------------------------------
+
+HANDSHAKE_ROUNDS = 100
+
+def _register_key_agreement(name, post_quantum, threads=0):
+    @benchmark(f"handshake.{name}", max_rounds=HANDSHAKE_ROUNDS)
+    def _key_agreement():
+        # End to end: bundle verification, initiate and respond, one one-time prekey each
+        alice, bob = pqxdh_handshake.User("Alice"), pqxdh_handshake.User("Bob")
+        prekeys = iter(bob.add_one_time_prekeys(HANDSHAKE_ROUNDS + 2))
+        executor = ThreadPoolExecutor(threads) if threads else None
+
+        def handshake():
+            _, _, message = pqxdh_handshake.initiate(alice, bob.bundle(next(prekeys)), executor, post_quantum)
+            pqxdh_handshake.respond(bob, message, executor)
+        return handshake
+
+_register_key_agreement("x3dh", post_quantum=False)
+_register_key_agreement("pqxdh", post_quantum=True)
+_register_key_agreement("pqxdh[threads=4]", post_quantum=True, threads=4)
+
+# --- Double Ratchet in double_rachet.py -----------------------------------------
+
+RATCHET_MESSAGES = 1000
+
+def _register_ratchet(order, header_encryption):
+    variant = "he." if header_encryption else ""
+
+    @benchmark(f"ratchet.{variant}{order}[{RATCHET_MESSAGES}]", items=RATCHET_MESSAGES, max_rounds=10)
+    def _ratchet():
+        # Fixed delivery order so runs are comparable; out of order stays within MAX_SKIP
+        delivery = list(range(RATCHET_MESSAGES))
+        if order == "out_of_order":
+            random.Random(0).shuffle(delivery)
+
+        def exchange():
+            alice, bob = double_rachet.session_pair(header_encryption)
+            sent = [alice.encrypt(b"x" * 64, b"AD") for _ in range(RATCHET_MESSAGES)]
+            for i in delivery:
+                bob.decrypt(*sent[i], b"AD")
+        return exchange
+
+for _order in ("in_order", "out_of_order"):
+    _register_ratchet(_order, header_encryption=False)
+    _register_ratchet(_order, header_encryption=True)
+
+@benchmark("ratchet.ping_pong[100]", items=100, max_rounds=10)
+def _ratchet_ping_pong():
+    # Every reply triggers a DH ratchet step on both sides
+    def exchange():
+        alice, bob = double_rachet.session_pair()
+        for _ in range(50):
+            bob.decrypt(*alice.encrypt(b"x" * 64, b"AD"), b"AD")
+            alice.decrypt(*bob.encrypt(b"x" * 64, b"AD"), b"AD")
+    return exchange
+
+@benchmark("ratchet.lossy[5000]", items=5000, max_rounds=5)
+def _ratchet_lossy():
+    # Ten chains of 500 messages with only the last one delivered: each gap is
+    # stored as chain-key checkpoints, 32 per chain, well under MAX_SKIPPED_KEYS
+    def exchange():
+        alice, bob = double_rachet.session_pair()
+        for _ in range(10):
+            sent = [alice.encrypt(b"x" * 64, b"AD") for _ in range(500)]
+            bob.decrypt(*sent[-1], b"AD")
+            alice.decrypt(*bob.encrypt(b"x" * 64, b"AD"), b"AD")
+    return exchange
+
+LOSSY_CHAINS = 200
+
+@benchmark(f"ratchet.lossy.short_gaps[{LOSSY_CHAINS * (double_rachet.CHECKPOINT_INTERVAL + 1)}]",
+           items=LOSSY_CHAINS * (double_rachet.CHECKPOINT_INTERVAL + 1), max_rounds=5)
+def _ratchet_lossy_short_gaps():
+    # Gaps of CHECKPOINT_INTERVAL keys are stored one key per position, so 200
+    # chains of them overflow MAX_SKIPPED_KEYS and the store evicts the oldest
+    def exchange():
+        alice, bob = double_rachet.session_pair()
+        for _ in range(LOSSY_CHAINS):
+            sent = [alice.encrypt(b"x" * 64, b"AD") for _ in range(double_rachet.CHECKPOINT_INTERVAL + 1)]
+            bob.decrypt(*sent[-1], b"AD")
+            alice.decrypt(*bob.encrypt(b"x" * 64, b"AD"), b"AD")
+        if not bob.MKSKIPPED.evictions:
+            raise ValueError("ratchet.lossy.short_gaps never reached MAX_SKIPPED_KEYS")
+    return exchange
+
+@benchmark("ratchet.catch_up[5000]", items=5000, max_rounds=5)
+def _ratchet_catch_up():
+    # A client back online receives the newest message first, then the backlog in
+    # order: the gap is stored as chain-key checkpoints and walked forward
+    def exchange():
+        alice, bob = double_rachet.session_pair()
+        sent = [alice.encrypt(b"x" * 64, b"AD") for _ in range(5000)]
+        bob.decrypt(*sent[-1], b"AD")
+        for message in sent[:-1]:
+            bob.decrypt(*message, b"AD")
+    return exchange
+
+def _register_skipped_decrypt(skipped):
+    # Latency of decrypting one skipped, header-encrypted message with this many
+    # keys stored across chains of up to 500; each call consumes one of them
+    @benchmark(f"ratchet.he.skipped_decrypt[{skipped}]", max_rounds=skipped - 2)
+    def _skipped_decrypt():
+        alice, bob = double_rachet.session_pair(header_encryption=True)
+        pending = []
+        while len(pending) < skipped:
+            count = min(500, skipped - len(pending))
+            sent = [alice.encrypt(b"x" * 64, b"AD") for _ in range(count + 1)]
+            bob.decrypt(*sent[-1], b"AD")
+            pending += sent[:-1]
+            alice.decrypt(*bob.encrypt(b"x" * 64, b"AD"), b"AD")
+        random.Random(0).shuffle(pending)
+        return lambda: bob.decrypt(*pending.pop(), b"AD")
+
+for _skipped in (10, 100, 1000, 2000):
+    _register_skipped_decrypt(_skipped)
+
+# --- Session store in session_store.py -----------------------------------------
+
+STORE_SESSIONS = 100_000
+
+@functools.lru_cache(maxsize=None)
+def _store_file():
+    """Path of a store holding STORE_SESSIONS ratchet sessions, built once per run"""
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    path = os.path.join(directory, "sessions.db")
+    alice, _ = double_rachet.session_pair()
+    with session_store.SessionStore(path, initial_records=STORE_SESSIONS) as store:
+        for i in range(STORE_SESSIONS):
+            store.save(i.to_bytes(8, "big"), alice)
+    return path
+
+def _store_ids():
+    rng = random.Random(0)
+    return (rng.randrange(STORE_SESSIONS).to_bytes(8, "big") for _ in itertools.count())
+
+@benchmark(f"store.open[{STORE_SESSIONS // 1000}k]", items=STORE_SESSIONS, max_rounds=5)
+def _store_open():
+    # Rebuilding the id index after a restart; ops/s is records/s
+    path = _store_file()
+    return lambda: session_store.SessionStore(path).close()
+
+def _register_store(operation, cache_size=0, sync=False):
+    if operation == "save":
+        mode = "sync" if sync else "nosync"
+    else:
+        mode = "hot" if cache_size else "cold"
+    label = f"{operation}[{mode},{STORE_SESSIONS // 1000}k]"
+
+    @benchmark(f"store.{label}", max_rounds=None if cache_size else 1000)
+    def _store():
+        store = session_store.SessionStore(_store_file(), cache_size=cache_size, sync=sync)
+        ids = _store_ids()
+        if operation == "load":
+            if cache_size:
+                hot = next(ids)
+                store.load(hot)
+                return lambda: store.load(hot)
+            return lambda: store.load(next(ids))
+        state = store.load(next(ids))
+        return lambda: store.save(next(ids), state)
+
+_register_store("load")
+_register_store("load", cache_size=10000)
+_register_store("save")
+_register_store("save", sync=True)
+
+# --- Prekey server in prekey_server.py -------------------------------------------
+
+PREKEY_SERVER_USERS = 100_000
+
+@functools.lru_cache(maxsize=None)
+def _prekey_server():
+    """PrekeyServer with PREKEY_SERVER_USERS devices of 20 one-time prekeys, built once per run"""
+    return prekey_server.populate(prekey_server.PrekeyServer(), PREKEY_SERVER_USERS)
+
+@benchmark(f"prekey_server.fetch[{PREKEY_SERVER_USERS // 1000}k]")
+def _prekey_server_fetch():
+    server = _prekey_server()
+    rng = random.Random(0)
+    return lambda: server.fetch_bundle(rng.randrange(PREKEY_SERVER_USERS), 1)
+
+@benchmark("prekey_server.fetch[exhausted]")
+def _prekey_server_fetch_exhausted():
+    # A device with no one-time prekeys left: last-resort KEM prekey, no OPK
+    server = prekey_server.populate(prekey_server.PrekeyServer(), 1, one_time=0)
+    return lambda: server.fetch_bundle(0, 1)
+
+@benchmark("prekey_server.upload[100]", items=100)
+def _prekey_server_upload():
+    server = prekey_server.populate(prekey_server.PrekeyServer(), 1, one_time=0)
+    prekeys = [(i, bytes(32)) for i in range(100)]
+    return lambda: server.upload_one_time_prekeys(0, 1, prekeys)
+
+# --- Memory ------------------------------------------------------------------
+
+def memory_per_session(count=1000):
+    """Bytes retained per established session (the receiving Person and its SignalStyleSession)"""
+    alice, _ = _handshake_pair()
+    sessions = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(count):
+            _, bob = _handshake_pair()
+            bob.decapsulate(alice.encapsulate(bob.generate_keypair()))
+            session = SignalStyleSession(bob)
+            session.current_receiving_key = bob.shared_secret
+            sessions.append(session)
+        # Expanded matrices live in the shared, size-capped cache, not in the sessions
+        sampling.matrix_cache.clear()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {'sessions': count, 'bytes_per_session': retained / count}
+
+# --- Reporting ---------------------------------------------------------------
+
+def print_result(name, result, baseline=None):
+    """One report line, with the change against a baseline run when given"""
+    line = (f"{name:<40} {result['ops_per_sec']:>12.1f} ops/s"
+            f"  p50 {result['p50_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms")
+    if baseline and name in baseline:
+        change = result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1
+        line += f"  {change:+7.1%}"
+    print(line)
+
+def regressions(results, baseline, threshold):
+    """Cases whose throughput dropped by more than threshold against the baseline"""
+    return [name for name, result in results.items()
+            if name in baseline and result['ops_per_sec'] < baseline[name]['ops_per_sec'] * (1 - threshold)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pqxdh KEMs, DH and session AEAD")
+    parser.add_argument("--rounds", type=int, default=50, help="timed calls per case")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--json", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="throughput drop that counts as a regression (default 10%%)")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("--memory", type=int, metavar="SESSIONS",
+                        help="also report bytes retained per session over this many sessions")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        sys.exit(0)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for name, result in run(names, args.rounds):
+        results[name] = result
+        print_result(name, result, baseline)
+
+    memory = None
+    if args.memory:
+        memory = memory_per_session(args.memory)
+        print(f"{'memory.per_session':<40} {memory['bytes_per_session']:>12.0f} bytes"
+              f"  over {memory['sessions']} sessions")
+
+    if args.json:
+        report = {'environment': environment(), 'results': results}
+        if memory:
+            report['memory'] = memory
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        for name in slower:
+            print(f"REGRESSION: {name}")
+        sys.exit(1 if slower else 0)
@@ -3,7 +3,12 @@ import hashlib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
+import logging
 import os
+import sys
+import diagnostics
+
+logger = diagnostics.get_logger("dh")
 
 def is_prime(n):
     """Check if a number is prime"""
@@ -52,8 +57,8 @@ class Person:
         self.shared_secret = pow(other_public_key, self.private_key, self.p)
         # Convert to a key suitable for encryption
         self.encryption_key = hashlib.sha256(str(self.shared_secret).encode()).digest()
-        print(f"{self.name}'s shared secret: {self.shared_secret}")
-        print(f"{self.name}'s encryption key: {self.encryption_key.hex()}")
+        # Never log the secret or the key itself
+        logger.debug("%s derived a shared secret", self.name)
         return self.shared_secret
     
     def encrypt_message(self, message):
@@ -97,6 +102,9 @@ class Person:
 
 # Demonstration
 if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    logger.setLevel(logging.DEBUG)
+
     # Choose a large prime number and a primitive root
     p = 23  # In practice, use a much larger prime
     g = find_primitive_root(p)
@@ -116,6 +124,9 @@ if __name__ == "__main__":
     alice.generate_shared_secret(bob.public_key)
     bob.generate_shared_secret(alice.public_key)
     
+    print(f"Alice's encryption key: {alice.encryption_key.hex()}")
+    print(f"Bob's encryption key: {bob.encryption_key.hex()}")
+
     # Verify that both parties have the same shared secret
     print(f"Shared secrets match: {alice.shared_secret == bob.shared_secret}")
     
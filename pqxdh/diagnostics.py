@@ -0,0 +1,57 @@
+import logging
+import logging.handlers
+import queue
+import threading
+
+# Diagnostic logging for the pqxdh directory.
+#
+# Every module logs under the "pqxdh" logger with lazy %-style arguments, so a
+# disabled level costs a single isEnabledFor check and nothing is formatted.
+# A NullHandler keeps the library silent until the application configures
+# logging. enable_async_logging() hands records to a queue served by a
+# background thread, so a handshake never waits on a terminal or pipe write.
+
+ROOT = "pqxdh"
+
+logging.getLogger(ROOT).addHandler(logging.NullHandler())
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+def get_logger(name):
+    """Logger for one module under the pqxdh hierarchy"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+def enable_async_logging(*handlers, level=logging.INFO):
+    """Send pqxdh records through a queue to handlers run on a background thread"""
+    global _listener, _queue_handler
+    disable_async_logging()
+    if not handlers:
+        handlers = (logging.StreamHandler(),)
+    records = queue.SimpleQueue()
+    root = logging.getLogger(ROOT)
+    with _lock:
+        _queue_handler = logging.handlers.QueueHandler(records)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        # The listener's handlers do the output; don't also hand records to the root logger
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+def disable_async_logging():
+    """Flush and stop the background listener started by enable_async_logging"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        # stop() drains the queue before joining the thread
+        _listener.stop()
+        root = logging.getLogger(ROOT)
+        root.removeHandler(_queue_handler)
+        root.setLevel(logging.NOTSET)
+        root.propagate = True
+        _listener = None
+        _queue_handler = None
@@ -1,13 +1,335 @@
-# Double Rachet
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict, namedtuple
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Double Ratchet (Signal specification, revision 1) with the spec's function
+# names. The external functions are instantiated as recommended there:
+# X25519 for GENERATE_DH/DH, HKDF-SHA256 for KDF_RK, HMAC-SHA256 for KDF_CK,
+# and AES-256-GCM for ENCRYPT and for the header encryption variant.
+
+MAX_SKIP = 5000  # Most message keys skipped in a single chain
+MAX_SKIPPED_KEYS = 2000  # Most skipped keys and checkpoints kept per session, across all chains
+# Gaps longer than this are stored as one chain-key checkpoint per interval
+# instead of one message key per position
+CHECKPOINT_INTERVAL = 16
+MAX_SKIPPED_AGE = None  # Seconds a skipped message key is kept; None keeps it until evicted
+
+KDF_RK_INFO = b"DoubleRatchet root"
+ENCRYPT_INFO = b"DoubleRatchet message"
+HEADER_SIZE = 40  # dh (32) || pn (4) || n (4)
+
+DHKeyPair = namedtuple('DHKeyPair', ['private', 'public'])
+Header = namedtuple('Header', ['dh', 'pn', 'n'])
+
+class SkippedKeyStore:
+    """Skipped message keys in insertion order, bounded by count and optionally by age
+
+    Keys are (dh or header key, n) pairs. They are only ever added at the
+    newest end and read once, so the oldest entry is always the least recently
+    used one and every operation is O(1). The first half of each key is also
+    indexed, so header encryption can try each distinct header key once.
+
+    Long gaps are stored as chain-key checkpoints instead: one entry per run of
+    at most CHECKPOINT_INTERVAL positions, from which a message key is derived
+    only when it is asked for.
+    """
+    __slots__ = ('max_keys', 'max_age', 'hits', 'misses', 'evictions', 'expirations', 'derivations',
+                 '_entries', '_checkpoints', '_blocks', '_groups')
+
+    def __init__(self, max_keys=None, max_age=None):
+        self.max_keys = max_keys if max_keys is not None else MAX_SKIPPED_KEYS
+        self.max_age = max_age if max_age is not None else MAX_SKIPPED_AGE
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Dropped to stay under max_keys
+        self.expirations = 0  # Dropped for being older than max_age
+        self.derivations = 0  # KDF_CK steps taken from checkpoints
+        self._entries = OrderedDict()  # (header key or dh, n) -> (mk, time added)
+        # (group, first n) -> [chain key at next, next, end, consumed n set, time added]
+        self._checkpoints = OrderedDict()
+        self._blocks = {}  # (group, n // CHECKPOINT_INTERVAL) -> first n of each checkpoint in it
+        self._groups = {}  # header key or dh -> number of entries and checkpoints under it
+
+    def _forget(self, key):
+        """Update the group index for an entry that was just removed"""
+        group = key[0]
+        remaining = self._groups[group] - 1
+        if remaining:
+            self._groups[group] = remaining
+        else:
+            del self._groups[group]
+
+    def _drop_checkpoint(self, key):
+        del self._checkpoints[key]
+        block = (key[0], key[1] // CHECKPOINT_INTERVAL)
+        firsts = self._blocks[block]
+        firsts.remove(key[1])
+        if not firsts:
+            del self._blocks[block]
+        self._forget(key)
+
+    def _drop_oldest(self):
+        """Remove the oldest entry or checkpoint"""
+        entries, checkpoints = self._entries, self._checkpoints
+        if checkpoints and (not entries or
+                            next(iter(checkpoints.values()))[4] <= next(iter(entries.values()))[1]):
+            self._drop_checkpoint(next(iter(checkpoints)))
+        else:
+            self._forget(entries.popitem(last=False)[0])
+
+    def _oldest_time(self):
+        times = []
+        if self._entries:
+            times.append(next(iter(self._entries.values()))[1])
+        if self._checkpoints:
+            times.append(next(iter(self._checkpoints.values()))[4])
+        return min(times) if times else None
+
+    def _expire(self, now):
+        if self.max_age is None:
+            return
+        while len(self) and now - self._oldest_time() > self.max_age:
+            self._drop_oldest()
+            self.expirations += 1
+
+    def _evict(self):
+        while len(self) > self.max_keys:
+            self._drop_oldest()
+            self.evictions += 1
+
+    def __setitem__(self, key, mk):
+        now = time.monotonic()
+        self._expire(now)
+        if key not in self._entries:
+            self._groups[key[0]] = self._groups.get(key[0], 0) + 1
+        self._entries[key] = (mk, now)
+        self._evict()
+
+    def add_checkpoint(self, group, first, end, ck):
+        """Record that positions first..end-1 of a chain are skipped, with ck the chain key at first"""
+        if first // CHECKPOINT_INTERVAL != (end - 1) // CHECKPOINT_INTERVAL:
+            raise ValueError("A checkpoint must not cross a CHECKPOINT_INTERVAL boundary")
+        now = time.monotonic()
+        self._expire(now)
+        self._checkpoints[group, first] = [ck, first, end, set(), now]
+        self._blocks.setdefault((group, first // CHECKPOINT_INTERVAL), []).append(first)
+        self._groups[group] = self._groups.get(group, 0) + 1
+        self._evict()
+
+    def _find_checkpoint(self, key):
+        """(checkpoint key, record) covering key, or None"""
+        group, n = key
+        for first in self._blocks.get((group, n // CHECKPOINT_INTERVAL), ()):
+            record = self._checkpoints[group, first]
+            if record[1] <= n < record[2] and n not in record[3]:
+                return (group, first), record
+        return None
+
+    def _expired(self, added):
+        return self.max_age is not None and time.monotonic() - added > self.max_age
+
+    def get(self, key):
+        """The message key for key, or None; counts a hit or a miss"""
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry[1]):
+            del self[key]
+            self.expirations += 1
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+
+        found = self._find_checkpoint(key) if self._checkpoints else None
+        if found is not None and self._expired(found[1][4]):
+            self._drop_checkpoint(found[0])
+            self.expirations += 1
+            found = None
+        if found is None:
+            self.misses += 1
+            return None
+        ck, position = found[1][0], found[1][1]
+        for _ in range(key[1] - position):
+            ck = KDF_CK_NEXT(ck)
+        self.derivations += key[1] - position + 1
+        self.hits += 1
+        return KDF_CK(ck)[1]
+
+    def __delitem__(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self._forget(key)
+            return
+        found = self._find_checkpoint(key)
+        if found is None:
+            raise KeyError(key)
+        checkpoint_key, record = found
+        consumed = record[3]
+        consumed.add(key[1])
+        # Move the checkpoint past a consumed prefix so in-order catch-up stays cheap
+        while record[1] in consumed:
+            consumed.remove(record[1])
+            record[0] = KDF_CK_NEXT(record[0])
+            record[1] += 1
+        if record[1] >= record[2]:
+            self._drop_checkpoint(checkpoint_key)
+
+    def __contains__(self, key):
+        return key in self._entries or (bool(self._checkpoints) and self._find_checkpoint(key) is not None)
+
+    def __len__(self):
+        """Stored entries; a checkpoint counts once however many keys it covers"""
+        return len(self._entries) + len(self._checkpoints)
+
+    def groups(self):
+        """Distinct first halves of the stored keys (dh values or header keys), oldest first"""
+        self._expire(time.monotonic())
+        return list(self._groups)
+
+    def add_pending(self, pending):
+        """Store what SkipMessageKeys collected, in order: (key, mk) pairs and (group, first, end, ck) checkpoints"""
+        for item in pending:
+            if len(item) == 2:
+                self[item[0]] = item[1]
+            else:
+                self.add_checkpoint(*item)
+
+    def stats(self):
+        """Counters for monitoring memory pressure from reordering"""
+        return {'size': len(self._entries), 'checkpoints': len(self._checkpoints),
+                'groups': len(self._groups), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'derivations': self.derivations}
+
+class RatchetState:
+    """Ratchet variables of one party; the HE fields are only used by the header encryption variant"""
+    __slots__ = ('DHs', 'DHr', 'RK', 'CKs', 'CKr', 'Ns', 'Nr', 'PN', 'MKSKIPPED',
+                 'DHRs', 'DHRr', 'HKs', 'HKr', 'NHKs', 'NHKr')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def snapshot(self):
+        """Ratchet variables to undo a failed decryption with; MKSKIPPED is not included
+
+        Decryption only adds skipped keys to MKSKIPPED once the message has
+        authenticated, so a snapshot costs the same however many keys are stored.
+        """
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def restore(self, snapshot):
+        for name, value in zip(self.__slots__, snapshot):
+            setattr(self, name, value)
+
+    def encrypt(self, plaintext, AD=b""):
+        """RatchetEncrypt or RatchetEncryptHE, depending on how the state was initialized"""
+        if self.DHRs is not None:
+            return RatchetEncryptHE(self, plaintext, AD)
+        return RatchetEncrypt(self, plaintext, AD)
+
+    def decrypt(self, header, ciphertext, AD=b""):
+        """RatchetDecrypt or RatchetDecryptHE, depending on how the state was initialized"""
+        if self.DHRs is not None:
+            return RatchetDecryptHE(self, header, ciphertext, AD)
+        return RatchetDecrypt(self, header, ciphertext, AD)
+
+# External functions
+
+def GENERATE_DH():
+    private = X25519PrivateKey.generate()
+    return DHKeyPair(private, private.public_key().public_bytes_raw())
+
+def DH(dh_pair, dh_pub):
+    private = dh_pair.private
+    if isinstance(private, bytes):
+        # Loaded from a session store as raw bytes; building the key object is deferred to here
+        private = X25519PrivateKey.from_private_bytes(private)
+    return private.exchange(X25519PublicKey.from_public_bytes(dh_pub))
+
+def HKDF(salt, ikm, info, length):
+    """HKDF-SHA256 (RFC 5869) on the one-shot hmac.digest fast path"""
+    prk = hmac.digest(salt, ikm, 'sha256')
+    okm = b""
+    block = b""
+    counter = 1
+    while len(okm) < length:
+        block = hmac.digest(prk, block + info + bytes([counter]), 'sha256')
+        okm += block
+        counter += 1
+    return okm[:length]
+
+def KDF_RK(rk, dh_out):
+    okm = HKDF(rk, dh_out, KDF_RK_INFO, 64)
+    return okm[:32], okm[32:]
+
+def KDF_CK(ck):
+    # One HMAC key schedule per step; the two outputs continue from a copy of it
+    mac = hmac.new(ck, digestmod=hashlib.sha256)
+    message_key = mac.copy()
+    mac.update(b"\x02")
+    message_key.update(b"\x01")
+    return mac.digest(), message_key.digest()
+
+def KDF_CK_NEXT(ck):
+    """Only the next chain key of KDF_CK, for positions whose message key is not needed"""
+    return hmac.digest(ck, b"\x02", 'sha256')
+
+def HEADER(dh_pair, pn, n):
+    return Header(dh_pair.public, pn, n)
+
+def ENCODE_HEADER(header):
+    return header.dh + header.pn.to_bytes(4, 'big') + header.n.to_bytes(4, 'big')
+
+def DECODE_HEADER(data):
+    if len(data) != HEADER_SIZE:
+        raise ValueError("Invalid header length")
+    return Header(bytes(data[:32]), int.from_bytes(data[32:36], 'big'), int.from_bytes(data[36:40], 'big'))
+
+def CONCAT(AD, header):
+    # Encrypted headers are already bytes
+    if isinstance(header, Header):
+        header = ENCODE_HEADER(header)
+    return AD + header
+
+# HKDF-Extract with the all-zero salt, keyed once and copied for every message
+_MESSAGE_EXTRACT = hmac.new(bytes(32), digestmod=hashlib.sha256)
+
+def _message_cipher(mk):
+    """AES-256-GCM key and nonce for a message key: HKDF(zero salt, mk, ENCRYPT_INFO, 44)"""
+    extract = _MESSAGE_EXTRACT.copy()
+    extract.update(mk)
+    expand = hmac.new(extract.digest(), digestmod=hashlib.sha256)
+    first = expand.copy()
+    first.update(ENCRYPT_INFO + b"\x01")
+    t1 = first.digest()
+    expand.update(t1 + ENCRYPT_INFO + b"\x02")
+    # Each message key is used once, so the nonce can come from the key derivation
+    return AESGCM(t1), expand.digest()[:12]
+
+def ENCRYPT(mk, plaintext, associated_data):
+    aead, nonce = _message_cipher(mk)
+    return aead.encrypt(nonce, plaintext, associated_data)
+
+def DECRYPT(mk, ciphertext, associated_data):
+    # Raises InvalidTag if the message does not authenticate
+    aead, nonce = _message_cipher(mk)
+    return aead.decrypt(nonce, ciphertext, associated_data)
+
+# Double Ratchet
 def RatchetInitAlice(state, SK, bob_dh_public_key):
     state.DHs = GENERATE_DH()
     state.DHr = bob_dh_public_key
-    state.RK, state.CKs = KDF_RK(SK, DH(state.DHs, state.DHr)) 
+    state.RK, state.CKs = KDF_RK(SK, DH(state.DHs, state.DHr))
     state.CKr = None
     state.Ns = 0
     state.Nr = 0
     state.PN = 0
-    state.MKSKIPPED = {}
+    state.MKSKIPPED = SkippedKeyStore()
 
 def RatchetInitBob(state, SK, bob_dh_key_pair):
     state.DHs = bob_dh_key_pair
@@ -18,7 +340,7 @@ def RatchetInitBob(state, SK, bob_dh_key_pair):
     state.Ns = 0
     state.Nr = 0
     state.PN = 0
-    state.MKSKIPPED = {}
+    state.MKSKIPPED = SkippedKeyStore()
 
 def RatchetEncrypt(state, plaintext, AD):
     state.CKs, mk = KDF_CK(state.CKs)
@@ -30,33 +352,63 @@ def RatchetDecrypt(state, header, ciphertext, AD):
     plaintext = TrySkippedMessageKeys(state, header, ciphertext, AD)
     if plaintext != None:
         return plaintext
-    if header.dh != state.DHr:                 
-        SkipMessageKeys(state, header.pn)
-        DHRatchet(state, header)
-    SkipMessageKeys(state, header.n)             
-    state.CKr, mk = KDF_CK(state.CKr)
+    # The next in-order message only touches CKr and Nr, which are committed after
+    # it authenticates; skipping or ratcheting first keeps a snapshot to roll back
+    # to, and the skipped keys wait in pending until the message authenticates
+    snapshot = None
+    pending = []
+    if header.dh != state.DHr or header.n != state.Nr:
+        snapshot = state.snapshot()
+    try:
+        if header.dh != state.DHr:
+            SkipMessageKeys(state, header.pn, pending)
+            DHRatchet(state, header)
+        SkipMessageKeys(state, header.n, pending)
+        if state.CKr is None:
+            raise ValueError("No receiving chain")
+        CKr, mk = KDF_CK(state.CKr)
+        plaintext = DECRYPT(mk, ciphertext, CONCAT(AD, header))
+    except (InvalidTag, ValueError):
+        if snapshot is not None:
+            state.restore(snapshot)
+        raise
+    state.MKSKIPPED.add_pending(pending)
+    state.CKr = CKr
     state.Nr += 1
-    return DECRYPT(mk, ciphertext, CONCAT(AD, header))
+    return plaintext
 
 def TrySkippedMessageKeys(state, header, ciphertext, AD):
-    if (header.dh, header.n) in state.MKSKIPPED:
-        mk = state.MKSKIPPED[header.dh, header.n]
+    mk = state.MKSKIPPED.get((header.dh, header.n))
+    if mk != None:
+        plaintext = DECRYPT(mk, ciphertext, CONCAT(AD, header))
         del state.MKSKIPPED[header.dh, header.n]
-        return DECRYPT(mk, ciphertext, CONCAT(AD, header))
+        return plaintext
     else:
         return None
 
-def SkipMessageKeys(state, until):
+def SkipMessageKeys(state, until, pending):
+    """Skip to until, appending the skipped keys to pending rather than MKSKIPPED"""
     if state.Nr + MAX_SKIP < until:
-        raise Error()
+        raise ValueError("Too many skipped messages")
     if state.CKr != None:
+        if until - state.Nr > CHECKPOINT_INTERVAL:
+            CheckpointMessageKeys(state, state.DHr, until, pending)
         while state.Nr < until:
             state.CKr, mk = KDF_CK(state.CKr)
-            state.MKSKIPPED[state.DHr, state.Nr] = mk
+            pending.append(((state.DHr, state.Nr), mk))
             state.Nr += 1
 
+def CheckpointMessageKeys(state, group, until, pending):
+    """Skip to until with one chain key per CHECKPOINT_INTERVAL positions instead of every message key"""
+    while state.Nr < until:
+        end = min(until, (state.Nr // CHECKPOINT_INTERVAL + 1) * CHECKPOINT_INTERVAL)
+        pending.append((group, state.Nr, end, state.CKr))
+        for _ in range(end - state.Nr):
+            state.CKr = KDF_CK_NEXT(state.CKr)
+        state.Nr = end
+
 def DHRatchet(state, header):
-    state.PN = state.Ns                          
+    state.PN = state.Ns
     state.Ns = 0
     state.Nr = 0
     state.DHr = header.dh
@@ -65,16 +417,34 @@ def DHRatchet(state, header):
     state.RK, state.CKs = KDF_RK(state.RK, DH(state.DHs, state.DHr))
 
 
-# Double Rachet with Header Encryption
+# Double Ratchet with Header Encryption
+
+def KDF_RK_HE(rk, dh_out):
+    okm = HKDF(rk, dh_out, KDF_RK_INFO, 96)
+    return okm[:32], okm[32:64], okm[64:]
+
+def HENCRYPT(hk, header):
+    # Header keys are reused across a whole chain, so the nonce is random
+    nonce = os.urandom(12)
+    return nonce + AESGCM(hk).encrypt(nonce, ENCODE_HEADER(header), None)
+
+def HDECRYPT(hk, enc_header):
+    if hk is None:
+        return None
+    try:
+        return DECODE_HEADER(AESGCM(hk).decrypt(enc_header[:12], enc_header[12:], None))
+    except InvalidTag:
+        return None
+
 def RatchetInitAliceHE(state, SK, bob_dh_public_key, shared_hka, shared_nhkb):
     state.DHRs = GENERATE_DH()
     state.DHRr = bob_dh_public_key
-    state.RK, state.CKs, state.NHKs = KDF_RK_HE(SK, DH(state.DHRs, state.DHRr)) 
+    state.RK, state.CKs, state.NHKs = KDF_RK_HE(SK, DH(state.DHRs, state.DHRr))
     state.CKr = None
     state.Ns = 0
     state.Nr = 0
     state.PN = 0
-    state.MKSKIPPED = {}
+    state.MKSKIPPED = SkippedKeyStore()
     state.HKs = shared_hka
     state.HKr = None
     state.NHKr = shared_nhkb
@@ -82,13 +452,13 @@ def RatchetInitAliceHE(state, SK, bob_dh_public_key, shared_hka, shared_nhkb):
 def RatchetInitBobHE(state, SK, bob_dh_key_pair, shared_hka, shared_nhkb):
     state.DHRs = bob_dh_key_pair
     state.DHRr = None
-    state.RK = SK 
+    state.RK = SK
     state.CKs = None
     state.CKr = None
     state.Ns = 0
     state.Nr = 0
     state.PN = 0
-    state.MKSKIPPED = {}
+    state.MKSKIPPED = SkippedKeyStore()
     state.HKs = None
     state.NHKs = shared_nhkb
     state.HKr = None
@@ -106,22 +476,43 @@ def RatchetDecryptHE(state, enc_header, ciphertext, AD):
     if plaintext != None:
         return plaintext
     header, dh_ratchet = DecryptHeader(state, enc_header)
-    if dh_ratchet:
-        SkipMessageKeysHE(state, header.pn)
-        DHRatchetHE(state, header)
-    SkipMessageKeysHE(state, header.n)
-    state.CKr, mk = KDF_CK(state.CKr)
+    snapshot = None
+    pending = []
+    if dh_ratchet or header.n != state.Nr:
+        snapshot = state.snapshot()
+    try:
+        if dh_ratchet:
+            SkipMessageKeysHE(state, header.pn, pending)
+            DHRatchetHE(state, header)
+        SkipMessageKeysHE(state, header.n, pending)
+        if state.CKr is None:
+            raise ValueError("No receiving chain")
+        CKr, mk = KDF_CK(state.CKr)
+        plaintext = DECRYPT(mk, ciphertext, CONCAT(AD, enc_header))
+    except (InvalidTag, ValueError):
+        if snapshot is not None:
+            state.restore(snapshot)
+        raise
+    state.MKSKIPPED.add_pending(pending)
+    state.CKr = CKr
     state.Nr += 1
-    return DECRYPT(mk, ciphertext, CONCAT(AD, enc_header))
+    return plaintext
 
 def TrySkippedMessageKeysHE(state, enc_header, ciphertext, AD):
-    for ((hk, n), mk) in state.MKSKIPPED.items():
+    # One trial decryption per distinct header key, then a dict lookup on n,
+    # instead of one trial decryption per skipped key
+    for hk in state.MKSKIPPED.groups():
         header = HDECRYPT(hk, enc_header)
-        if header != None and header.n == n:
-            del state.MKSKIPPED[hk, n]
-            return DECRYPT(mk, ciphertext, CONCAT(AD, enc_header))
+        if header != None:
+            # Only one header key can open the header, so a miss here is final
+            mk = state.MKSKIPPED.get((hk, header.n))
+            if mk == None:
+                return None
+            plaintext = DECRYPT(mk, ciphertext, CONCAT(AD, enc_header))
+            del state.MKSKIPPED[hk, header.n]
+            return plaintext
     return None
-  
+
 def DecryptHeader(state, enc_header):
     header = HDECRYPT(state.HKr, enc_header)
     if header != None:
@@ -129,17 +520,19 @@ def DecryptHeader(state, enc_header):
     header = HDECRYPT(state.NHKr, enc_header)
     if header != None:
         return header, True
-    raise Error()
+    raise ValueError("Header does not decrypt under the current or next header key")
 
-def SkipMessageKeysHE(state, until):
+def SkipMessageKeysHE(state, until, pending):
     if state.Nr + MAX_SKIP < until:
-        raise Error()
+        raise ValueError("Too many skipped messages")
     if state.CKr != None:
+        if until - state.Nr > CHECKPOINT_INTERVAL:
+            CheckpointMessageKeys(state, state.HKr, until, pending)
         while state.Nr < until:
             state.CKr, mk = KDF_CK(state.CKr)
-            state.MKSKIPPED[state.HKr, state.Nr] = mk
+            pending.append(((state.HKr, state.Nr), mk))
             state.Nr += 1
-            
+
 def DHRatchetHE(state, header):
     state.PN = state.Ns
     state.Ns = 0
@@ -149,4 +542,60 @@ def DHRatchetHE(state, header):
     state.DHRr = header.dh
     state.RK, state.CKr, state.NHKr = KDF_RK_HE(state.RK, DH(state.DHRs, state.DHRr))
     state.DHRs = GENERATE_DH()
-    state.RK, state.CKs, state.NHKs = KDF_RK_HE(state.RK, DH(state.DHRs, state.DHRr))
\ No newline at end of file
+    state.RK, state.CKs, state.NHKs = KDF_RK_HE(state.RK, DH(state.DHRs, state.DHRr))
+
+def session_pair(header_encryption=False):
+    """Alice and Bob ratchet states after a handshake, keyed with fresh random secrets"""
+    SK = os.urandom(32)
+    bob_dh_key_pair = GENERATE_DH()
+    alice, bob = RatchetState(), RatchetState()
+    if header_encryption:
+        shared_hka, shared_nhkb = os.urandom(32), os.urandom(32)
+        RatchetInitAliceHE(alice, SK, bob_dh_key_pair.public, shared_hka, shared_nhkb)
+        RatchetInitBobHE(bob, SK, bob_dh_key_pair, shared_hka, shared_nhkb)
+    else:
+        RatchetInitAlice(alice, SK, bob_dh_key_pair.public)
+        RatchetInitBob(bob, SK, bob_dh_key_pair)
+    return alice, bob
+
+if __name__ == "__main__":
+    for header_encryption in (False, True):
+        variant = "with header encryption" if header_encryption else "plain headers"
+        print(f"\n--- Double Ratchet, {variant} ---")
+        alice, bob = session_pair(header_encryption)
+
+        # Alice sends three messages; Bob receives them out of order
+        sent = [alice.encrypt(f"Alice message {i}".encode(), b"AD") for i in range(3)]
+        for i in (2, 0, 1):
+            print(f"Bob decrypted: {bob.decrypt(*sent[i], b'AD').decode()}")
+
+        # Bob's reply triggers a DH ratchet step on both sides
+        header, ciphertext = bob.encrypt(b"Bob reply", b"AD")
+        print(f"Alice decrypted: {alice.decrypt(header, ciphertext, b'AD').decode()}")
+
+        # A tampered message is rejected and leaves Bob's state untouched
+        header, ciphertext = alice.encrypt(b"Alice again", b"AD")
+        try:
+            bob.decrypt(header, ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]), b"AD")
+        except InvalidTag:
+            print("Tampered message rejected")
+        print(f"Bob decrypted: {bob.decrypt(header, ciphertext, b'AD').decode()}")
+
+    # Lossy delivery across many chains: long gaps become checkpoints
+    alice, bob = session_pair()
+    for _ in range(10):
+        sent = [alice.encrypt(b"lossy", b"AD") for _ in range(500)]
+        bob.decrypt(*sent[-1], b"AD")
+        alice.decrypt(*bob.encrypt(b"ack", b"AD"), b"AD")
+    bob.decrypt(*sent[0], b"AD")
+    print(f"\nSkipped keys after 5000 lost messages: {bob.MKSKIPPED.stats()}")
+
+    # Short gaps are stored key by key, so enough of them hit MAX_SKIPPED_KEYS
+    alice, bob = session_pair()
+    for _ in range(200):
+        sent = [alice.encrypt(b"lossy", b"AD") for _ in range(CHECKPOINT_INTERVAL + 1)]
+        bob.decrypt(*sent[-1], b"AD")
+        alice.decrypt(*bob.encrypt(b"ack", b"AD"), b"AD")
+    stats = bob.MKSKIPPED.stats()
+    print(f"Skipped keys after {200 * CHECKPOINT_INTERVAL} lost messages in short gaps: {stats}")
+    print(f"Store held at MAX_SKIPPED_KEYS ({MAX_SKIPPED_KEYS}): {stats['size'] == MAX_SKIPPED_KEYS}")
@@ -0,0 +1,161 @@
+import bisect
+import contextlib
+import functools
+import logging
+import threading
+import time
+import pqxdh
+import test
+
+# Optional per-phase timing for the KEM classes.
+#
+# enable(sink) swaps timed wrappers onto the methods and functions listed in
+# PHASES; disable() puts the originals back. Nothing is wrapped until enable()
+# is called, so the uninstrumented hot path runs exactly the original code.
+
+# (owner, attribute, metric name): owner is a class or a module
+PHASES = [
+    # pqxdh.py Person
+    (pqxdh.Person, 'generate_keypair', 'person.keygen'),
+    (pqxdh.Person, 'encapsulate', 'person.encaps'),
+    (pqxdh.Person, 'decapsulate', 'person.decaps'),
+    (pqxdh.KyberParameters, 'gen_a', 'person.expand_a'),
+    (pqxdh.Person, '_gen_small_vector', 'person.sampling'),
+    (pqxdh.Person, '_matrix_vector_mul', 'person.ring'),
+    (pqxdh.Person, '_vector_dot', 'person.ring'),
+    (pqxdh.Person, '_hash_public_key', 'person.hash'),
+    (pqxdh.Person, '_derive_key_and_coins', 'person.hash'),
+    # test.py Kyber
+    (test.Kyber, '_keygen_many', 'kyber.keygen'),
+    (test.Kyber, '_encaps_many', 'kyber.encaps'),
+    (test.Kyber, '_decaps_many', 'kyber.decaps'),
+    (test.Kyber, '_matrices', 'kyber.expand_a'),
+    (test.Kyber, '_sample_vectors', 'kyber.sampling'),
+    (test, 'ntt', 'kyber.ring'),
+    (test, 'inv_ntt', 'kyber.ring'),
+    (test, 'matvec', 'kyber.ring'),
+    (test, 'dot', 'kyber.ring'),
+    (test, 'G', 'kyber.hash'),
+    (test, 'H', 'kyber.hash'),
+    (test, 'J', 'kyber.hash'),
+]
+
+_sink = None
+_originals = {}
+_lock = threading.Lock()
+
+def _timed(name, fn):
+    """Wrap fn so every call reports its wall time to the active sink"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sink = _sink
+            if sink is not None:
+                sink.record(name, time.perf_counter() - start)
+    return wrapper
+
+def enable(sink):
+    """Start recording phase timings into sink"""
+    global _sink
+    with _lock:
+        _sink = sink
+        if _originals:
+            return
+        for owner, attribute, name in PHASES:
+            original = owner.__dict__[attribute]
+            _originals[owner, attribute] = original
+            setattr(owner, attribute, _timed(name, original))
+
+def disable():
+    """Stop recording and restore the original, unwrapped code"""
+    global _sink
+    with _lock:
+        for (owner, attribute), original in _originals.items():
+            setattr(owner, attribute, original)
+        _originals.clear()
+        _sink = None
+
+@contextlib.contextmanager
+def instrumented(sink):
+    """Record phase timings into sink for the duration of a with block"""
+    enable(sink)
+    try:
+        yield sink
+    finally:
+        disable()
+
+class HistogramSink:
+    """In-memory latency histograms per phase"""
+    # Bucket upper bounds in seconds, 10 us to 10 s
+    BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+               1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(self.BUCKETS) + 1)}
+            phase['count'] += 1
+            phase['sum'] += seconds
+            phase['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def summary(self):
+        """{phase: (count, total seconds, mean seconds)}"""
+        with self._lock:
+            return {name: (p['count'], p['sum'], p['sum'] / p['count']) for name, p in self.phases.items()}
+
+    def reset(self):
+        with self._lock:
+            self.phases.clear()
+
+class PrometheusSink(HistogramSink):
+    """Histogram sink that renders the Prometheus text exposition format"""
+    def __init__(self, metric="pqxdh_phase_duration_seconds"):
+        super().__init__()
+        self.metric = metric
+
+    def render(self):
+        """Current histograms as Prometheus text"""
+        lines = [f"# HELP {self.metric} Wall time spent in each KEM phase.",
+                 f"# TYPE {self.metric} histogram"]
+        with self._lock:
+            for name, phase in sorted(self.phases.items()):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + (float("inf"),), phase['buckets']):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.metric}_bucket{{phase="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{self.metric}_sum{{phase="{name}"}} {phase["sum"]}')
+                lines.append(f'{self.metric}_count{{phase="{name}"}} {phase["count"]}')
+        return "\n".join(lines) + "\n"
+
+class LoggingSink:
+    """Log every phase timing through the standard logging module"""
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger("pqxdh.instrumentation")
+        self.level = level
+
+    def record(self, name, seconds):
+        # Lazy %-formatting: nothing is formatted unless the level is enabled
+        self.logger.log(self.level, "%s took %.3f ms", name, seconds * 1000)
+
+if __name__ == "__main__":
+    with instrumented(HistogramSink()) as sink:
+        alice = pqxdh.Person("Alice")
+        bob = pqxdh.Person("Bob")
+        bob.decapsulate(alice.encapsulate(bob.generate_keypair()))
+        kyber = test.Kyber()
+        public_key, secret_key = kyber.keygen()
+        ciphertext, _ = kyber.encaps(public_key)
+        kyber.decaps(ciphertext, secret_key)
+
+    print("\n--- Phase timings ---")
+    for name, (count, total, mean) in sorted(sink.summary().items()):
+        print(f"{name:<18} {count:4d} calls  {total * 1000:8.3f} ms total  {mean * 1000:7.3f} ms mean")
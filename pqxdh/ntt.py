@@ -0,0 +1,129 @@
+import numpy as np
+
+# Number-Theoretic Transform over Z_q[X]/(X^n + 1) as used by CRYSTALS-Kyber.
+# Every function works on the last axis, so a single polynomial (n,), a
+# vector (k, n), a matrix (k, k, n) or a batch of any of those is transformed
+# with the same handful of whole-array NumPy operations.
+
+Q = 3329  # Kyber modulus
+N = 256   # Polynomial ring dimension
+ZETA = 17  # Primitive 256-th root of unity mod q
+
+# Barrett reduction constants: v = round(2^26 / q)
+BARRETT_SHIFT = 26
+BARRETT_V = ((1 << BARRETT_SHIFT) + Q // 2) // Q
+
+N_INV = pow(128, -1, Q)  # Scaling factor for the inverse transform (128^-1 mod q)
+
+def _bit_reverse7(i):
+    """Reverse the 7 low bits of i"""
+    return int(f"{i:07b}"[::-1], 2)
+
+# zeta^BitRev7(i) for the butterflies and zeta^(2*BitRev7(i)+1) for base multiplication
+ZETAS = np.array([pow(ZETA, _bit_reverse7(i), Q) for i in range(128)], dtype=np.int64)
+GAMMAS = np.array([pow(ZETA, 2 * _bit_reverse7(i) + 1, Q) for i in range(128)], dtype=np.int64)
+
+def barrett_reduce(a):
+    """Reduce non-negative coefficients below 2^26 into [0, q)"""
+    t = (a * BARRETT_V) >> BARRETT_SHIFT
+    r = a - t * Q
+    # The quotient estimate is at most one too large, so r is in [-q, q)
+    return r + ((r >> 63) & Q)
+
+def ntt(poly):
+    """Number-Theoretic Transform - converts polynomials to NTT representation"""
+    f = np.array(poly, dtype=np.int64) % Q
+    shape = f.shape
+    length = N // 2
+    while length >= 2:
+        groups = N // (2 * length)
+        # Butterflies in place on a (groups, 2, length) view; additions are left
+        # unreduced (each layer adds < q), only the zeta products are reduced
+        view = f.reshape(shape[:-1] + (groups, 2, length))
+        lo = view[..., 0, :]
+        hi = view[..., 1, :]
+        t = ZETAS[groups:2 * groups, None] * hi
+        t %= Q
+        np.subtract(lo, t, out=hi)
+        hi += Q
+        lo += t
+        length //= 2
+    # Coefficients are below 8q after seven layers
+    return barrett_reduce(f)
+
+def inv_ntt(poly):
+    """Inverse NTT - converts from NTT representation back to polynomials"""
+    f = np.array(poly, dtype=np.int64) % Q
+    shape = f.shape
+    length = 2
+    while length <= N // 2:
+        groups = N // (2 * length)
+        view = f.reshape(shape[:-1] + (groups, 2, length))
+        lo = view[..., 0, :]
+        hi = view[..., 1, :]
+        # The inverse walks the zeta table backwards; sums grow to at most 128q
+        d = hi - lo
+        lo += hi
+        d *= ZETAS[groups:2 * groups][::-1, None]
+        np.remainder(d, Q, out=hi)
+        length *= 2
+    f %= Q
+    return barrett_reduce(f * N_INV)
+
+def basemul(a_hat, b_hat):
+    """Multiply polynomials in NTT domain (128 products of degree-1 pairs)"""
+    a = np.asarray(a_hat, dtype=np.int64)
+    b = np.asarray(b_hat, dtype=np.int64)
+    a0, a1 = a[..., 0::2], a[..., 1::2]
+    b0, b1 = b[..., 0::2], b[..., 1::2]
+    c = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.int64)
+    c[..., 0::2] = barrett_reduce(a0 * b0 + GAMMAS * barrett_reduce(a1 * b1))
+    c[..., 1::2] = barrett_reduce(a0 * b1 + a1 * b0)
+    return c
+
+def matvec(a_hat, s_hat):
+    """Matrix-vector product A·s in NTT domain: (..., k, k, n) x (..., k, n) -> (..., k, n)"""
+    products = basemul(a_hat, np.expand_dims(s_hat, -3))
+    return barrett_reduce(products.sum(axis=-2))
+
+def dot(a_hat, b_hat):
+    """Inner product a^T·b in NTT domain: (..., k, n) x (..., k, n) -> (..., n)"""
+    return barrett_reduce(basemul(a_hat, b_hat).sum(axis=-2))
+
+def poly_mul(a, b):
+    """Multiply polynomials in Z_q[X]/(X^n + 1) via the NTT"""
+    return inv_ntt(basemul(ntt(a), ntt(b)))
+
+def schoolbook_mul(a, b):
+    """Reference negacyclic multiplication (x^n = -1), O(n^2)"""
+    a = np.asarray(a, dtype=np.int64) % Q
+    b = np.asarray(b, dtype=np.int64) % Q
+    n = a.shape[-1]
+    full = np.convolve(a, b)
+    result = full[:n].copy()
+    result[:n - 1] -= full[n:]
+    return result % Q
+
+def cross_check(trials=100, seed=0):
+    """Compare NTT multiplication with schoolbook multiplication on random inputs"""
+    rng = np.random.default_rng(seed)
+    for _ in range(trials):
+        a = rng.integers(0, Q, size=N)
+        b = rng.integers(0, Q, size=N)
+        if not np.array_equal(poly_mul(a, b), schoolbook_mul(a, b)):
+            return False
+        if not np.array_equal(inv_ntt(ntt(a)), a):
+            return False
+
+    # Vectorized matrix-vector product against per-entry schoolbook products
+    k = 3
+    A = rng.integers(0, Q, size=(k, k, N))
+    s = rng.integers(-2, 3, size=(k, N))
+    expected = np.zeros((k, N), dtype=np.int64)
+    for i in range(k):
+        for j in range(k):
+            expected[i] = (expected[i] + schoolbook_mul(A[i][j], s[j])) % Q
+    return np.array_equal(inv_ntt(matvec(ntt(A), ntt(s))), expected)
+
+if __name__ == "__main__":
+    print(f"NTT matches schoolbook multiplication: {cross_check()}")
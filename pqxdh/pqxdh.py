@@ -1,18 +1,33 @@
 import secrets
 import hashlib
+import hmac
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
+import io
+import logging
 import os
+import sys
+import numpy as np
+import diagnostics
+import ring
+import sampling
+import serialize
 
 # Note: This is a simplified implementation for educational purposes
 # Real implementations would use specialized libraries like liboqs or PQClean
 
+logger = diagnostics.get_logger("kem")
+
 class KyberParameters:
     """
     Simplified parameters for Kyber
     In practice, use a proper PQ cryptography library
     """
+    __slots__ = ('k', 'n', 'q', 'eta1', 'eta2', 'du', 'dv')
+
     def __init__(self, k=3):  # k=3 for Kyber-768 (NIST level 3 security)
         self.k = k
         self.n = 256
@@ -23,114 +38,104 @@ class KyberParameters:
         self.dv = 4
         
     def gen_a(self, seed):
-        """Generate pseudorandom matrix A (simplified)"""
-        # In practice, this uses SHAKE-128 and has a specific structure
-        random_generator = hashlib.shake_128(seed)
-        a_matrix = []
-        for i in range(self.k):
-            row = []
-            for j in range(self.k):
-                # Generate pseudorandom coefficients mod q
-                coeffs = []
-                bytes_needed = (self.n * 16) // 8  # 16 bits per coefficient
-                random_bytes = random_generator.digest(bytes_needed)
-                
-                for l in range(0, bytes_needed, 2):
-                    if l + 1 < bytes_needed:
-                        val = (random_bytes[l] << 8) | random_bytes[l + 1]
-                        coeffs.append(val % self.q)
-                
-                # Ensure we have n coefficients
-                while len(coeffs) < self.n:
-                    coeffs.append(0)
-                
-                row.append(coeffs)
-            a_matrix.append(row)
-        return a_matrix
+        """Generate pseudorandom matrix A from a seed (uint16, cached per seed)"""
+        # Rejection sampling over SHAKE-128(seed || j || i), as in the Kyber spec
+        return sampling.matrix_cache.get(seed, self.k, self.n, self.q)
 
 class Person:
-    def __init__(self, name, params=None):
+    # Fixed attribute set: no per-instance __dict__ for large numbers of peers
+    __slots__ = ('name', 'params', 'backend', 'shared_secret', 'encryption_key', 'seed', 's', 't',
+                 'public_key', 'private_key', 'public_key_hash', 'z')
+
+    def __init__(self, name, params=None, backend=None):
         self.name = name
         self.params = params if params else KyberParameters()
+        # Polynomial arithmetic backend shared by matrix-vector and dot products
+        self.backend = backend if backend else ring.get_backend(self.params)
         self.shared_secret = None
         self.encryption_key = None
+        self.seed = None
+        self.s = None
+        self.t = None
+        self.public_key = None
+        self.private_key = None
+        self.public_key_hash = None
+        self.z = None
     
     def generate_keypair(self):
         """Generate a Kyber keypair (simplified)"""
         # Generate random seed for A matrix
         self.seed = secrets.token_bytes(32)
         
-        # Generate the public matrix A from the seed
-        self.A = self.params.gen_a(self.seed)
+        # Generate the public matrix A from the seed; only the seed is kept,
+        # A is regenerated (or fetched from the matrix cache) when needed
+        A = self.params.gen_a(self.seed)
         
-        # Generate secret vector s with small coefficients
+        # Generate secret vector s with small coefficients (int16)
         self.s = self._gen_small_vector(self.params.eta1)
         
         # Generate error vector e with small coefficients
-        self.e = self._gen_small_vector(self.params.eta2)
+        e = self._gen_small_vector(self.params.eta2)
         
-        # Compute public key t = A·s + e
-        self.t = self._matrix_vector_mul(self.A, self.s)
-        self._add_vectors(self.t, self.e)
+        # Compute public key t = A·s + e, stored as uint16 coefficients mod q
+        t = self._matrix_vector_mul(A, self.s)
+        self._add_vectors(t, e)
+        self.t = t.astype(np.uint16)
         
         # Return public key (seed for A, vector t)
         self.public_key = (self.seed, self.t)
         self.private_key = self.s
         
-        print(f"{self.name}'s keypair generated")
+        # Kept for decapsulation: hash of the public key and the implicit rejection secret
+        self.public_key_hash = self._hash_public_key(self.public_key)
+        self.z = secrets.token_bytes(32)
+        
+        logger.debug("%s generated a keypair", self.name)
         return self.public_key
 
-    def _gen_small_vector(self, eta):
-        """Generate a vector with small coefficients (simplified)"""
-        # In practice, this uses a binomial distribution centered at 0
-        result = []
-        for i in range(self.params.k):
-            coeffs = []
-            for j in range(self.params.n):
-                # Values between -eta and eta
-                val = secrets.randbelow(2*eta + 1) - eta
-                coeffs.append(val % self.params.q)  # Ensure it's in the ring
-            result.append(coeffs)
-        return result
+    def _gen_small_vector(self, eta, seed=None, nonce=0, count=None):
+        """Generate count (default k) polynomials with small coefficients in [-eta, eta] as an int16 (count, n) array"""
+        k, n = count or self.params.k, self.params.n
+        # Centered binomial distribution: 2·eta random bits per coefficient
+        length = k * n * 2 * eta // 8
+        if seed is None:
+            # One block of OS randomness for the whole vector
+            data = os.urandom(length)
+        else:
+            # Deterministic: SHAKE-256(seed || nonce)
+            data = sampling.prf(seed, nonce, length)
+        return sampling.cbd_from_bytes(data, eta).reshape(k, n)
     
     def _matrix_vector_mul(self, matrix, vector):
         """Matrix-vector multiplication in the ring"""
-        k = self.params.k
-        n = self.params.n
-        q = self.params.q
-        
-        result = []
-        for i in range(k):
-            row_result = [0] * n
-            for j in range(k):
-                # Polynomial multiplication (simplified)
-                for l in range(n):
-                    for m in range(n):
-                        idx = (l + m) % n
-                        row_result[idx] = (row_result[idx] + matrix[i][j][l] * vector[j][m]) % q
-            result.append(row_result)
-        return result
+        return self.backend.matvec(matrix, vector)
     
     def _add_vectors(self, vec1, vec2):
         """Add two vectors in place (vec1 += vec2)"""
-        for i in range(len(vec1)):
-            for j in range(len(vec1[i])):
-                vec1[i][j] = (vec1[i][j] + vec2[i][j]) % self.params.q
+        vec1 += np.asarray(vec2, dtype=vec1.dtype)
+        vec1 %= self.params.q
     
-    def encapsulate(self, recipient_public_key):
-        """Encapsulate a shared secret to the recipient (simplified)"""
-        # Unpack recipient's public key
-        recipient_seed, recipient_t = recipient_public_key
-        
-        # Regenerate matrix A from recipient's seed
-        A = self.params.gen_a(recipient_seed)
+    def _hash_public_key(self, public_key):
+        """H(pk) over the wire encoding of the public key"""
+        seed, t = public_key
+        return hashlib.sha3_256(serialize.encode_public_key(t, seed)).digest()
+    
+    def _derive_key_and_coins(self, m, public_key_hash):
+        """G(m || H(pk)): the shared secret and the encryption coins"""
+        derived = hashlib.sha3_512(m + public_key_hash).digest()
+        return derived[:32], derived[32:]
+    
+    def _encrypt(self, public_key, m, coins):
+        """Deterministically encrypt a 32-byte message m; all noise is derived from coins"""
+        seed, t = public_key
         
-        # Generate random vector r with small coefficients
-        r = self._gen_small_vector(self.params.eta1)
+        # Regenerate matrix A from the seed
+        A = self.params.gen_a(seed)
         
-        # Generate error vectors e1, e2 with small coefficients
-        e1 = self._gen_small_vector(self.params.eta2)
-        e2 = self._gen_small_vector(self.params.eta2)
+        # Generate vector r and error vectors e1, e2 with small coefficients
+        r = self._gen_small_vector(self.params.eta1, coins, 0)
+        e1 = self._gen_small_vector(self.params.eta2, coins, 1)
+        e2 = self._gen_small_vector(self.params.eta2, coins, 2, count=1)
         
         # Compute u = A^T·r + e1
         A_transpose = self._transpose(A)
@@ -138,97 +143,77 @@ class Person:
         self._add_vectors(u, e1)
         
         # Compute v = t^T·r + e2 + encode(m)
-        # For simplicity, we'll use a random message m
+        v = self._vector_dot(t, r)
+        v = (v + e2[0] + self._encode_message(m)) % self.params.q
+        
+        # The ciphertext is (u, v), compressed to du and dv bits per coefficient
+        return (serialize.compress(u, self.params.du), serialize.compress(v, self.params.dv))
+    
+    def _ciphertext_bytes(self, ciphertext):
+        """Wire encoding of a ciphertext"""
+        return serialize.encode_ciphertext(*ciphertext, self.params.du, self.params.dv)
+    
+    def encapsulate(self, recipient_public_key):
+        """Encapsulate a shared secret to the recipient"""
+        # Random message m; the shared secret and the encryption coins both come from G(m || H(pk))
         m = secrets.token_bytes(32)
-        v_temp = self._vector_dot(recipient_t, r)
-        for i in range(len(v_temp)):
-            v_temp[i] = (v_temp[i] + e2[0][i]) % self.params.q
+        shared_secret, coins = self._derive_key_and_coins(m, self._hash_public_key(recipient_public_key))
         
-        # Encode the message (simplified)
-        encoded_m = self._encode_message(m)
-        v = [(v_temp[i] + encoded_m[i]) % self.params.q for i in range(len(v_temp))]
+        ciphertext = self._encrypt(recipient_public_key, m, coins)
         
-        # Derive shared secret from message
-        self.shared_secret = hashlib.sha256(m).digest()
+        self.shared_secret = shared_secret
         self.encryption_key = self.shared_secret
         
-        # The ciphertext is (u, v)
-        ciphertext = (u, v)
-        
-        print(f"{self.name} encapsulated a shared secret")
+        logger.debug("%s encapsulated a shared secret", self.name)
         return ciphertext
     
     def decapsulate(self, ciphertext):
-        """Decapsulate the shared secret from the ciphertext (simplified)"""
+        """Decapsulate the shared secret from the ciphertext"""
         # Unpack the ciphertext
         u, v = ciphertext
+        u = serialize.decompress(u, self.params.du)
+        v = serialize.decompress(v, self.params.dv)
         
         # Compute s^T·u
         s_dot_u = self._vector_dot(self.s, u)
         
         # Subtract from v to get encode(m)
-        encoded_m = [(v[i] - s_dot_u[i]) % self.params.q for i in range(len(v))]
+        encoded_m = (v.astype(np.int64) - s_dot_u) % self.params.q
         
         # Decode to get the message
         m = self._decode_message(encoded_m)
         
-        # Derive the shared secret
-        self.shared_secret = hashlib.sha256(m).digest()
+        # Re-encrypt with the re-derived coins and compare (Fujisaki-Okamoto check)
+        shared_secret, coins = self._derive_key_and_coins(m, self.public_key_hash)
+        c = self._ciphertext_bytes(ciphertext)
+        if not hmac.compare_digest(c, self._ciphertext_bytes(self._encrypt(self.public_key, m, coins))):
+            # Implicit rejection: a pseudorandom key that reveals nothing
+            shared_secret = hashlib.shake_256(self.z + c).digest(32)
+        
+        self.shared_secret = shared_secret
         self.encryption_key = self.shared_secret
         
-        print(f"{self.name} decapsulated the shared secret")
+        logger.debug("%s decapsulated the shared secret", self.name)
         return self.shared_secret
     
     def _transpose(self, matrix):
         """Transpose a matrix"""
-        k = self.params.k
-        result = []
-        for i in range(k):
-            row = []
-            for j in range(k):
-                row.append(matrix[j][i])
-            result.append(row)
-        return result
+        return np.swapaxes(matrix, 0, 1)
     
     def _vector_dot(self, vec1, vec2):
         """Compute dot product of two vectors"""
-        k = self.params.k
-        n = self.params.n
-        q = self.params.q
-        
-        result = [0] * n
-        for i in range(k):
-            for l in range(n):
-                for m in range(n):
-                    idx = (l + m) % n
-                    result[idx] = (result[idx] + vec1[i][l] * vec2[i][m]) % q
-        return result
+        return self.backend.dot(vec1, vec2)
     
     def _encode_message(self, message):
-        """Encode a message into polynomial coefficients (simplified)"""
-        result = [0] * self.params.n
-        hash_value = hashlib.shake_256(message).digest(self.params.n)
-        
-        for i in range(min(len(hash_value), self.params.n)):
-            # Scale to approximately q/2 for binary encoding
-            result[i] = (hash_value[i] * (self.params.q // 256)) % self.params.q
-        
-        return result
+        """Encode a 32-byte message into polynomial coefficients: bit 1 -> round(q/2), bit 0 -> 0"""
+        bits = np.unpackbits(np.frombuffer(message, dtype=np.uint8), bitorder='little')
+        return serialize.decompress(bits, 1).astype(np.int64)
     
     def _decode_message(self, encoded):
-        """Decode polynomial coefficients back to message (simplified)"""
-        # This is highly simplified - real implementation would use proper decoding
-        # and error correction
-        result = bytearray(self.params.n)
-        for i in range(self.params.n):
-            # Determine if coefficient is closer to 0 or q/2
-            if encoded[i] > self.params.q // 4 and encoded[i] < 3 * self.params.q // 4:
-                result[i] = 1
-            else:
-                result[i] = 0
-        
-        # Hash the decoded bits to get the original message
-        return hashlib.shake_256(result).digest(32)
+        """Decode polynomial coefficients back to the 32-byte message"""
+        # A coefficient is a 1 bit when it is closer to q/2 than to 0
+        bits = serialize.compress(encoded, 1).astype(np.uint8)
+        return np.packbits(bits, bitorder='little').tobytes()
     
     def encrypt_message(self, message):
         """Encrypt a message using the shared secret"""
@@ -272,19 +257,84 @@ class Person:
         
         return plaintext.decode()
 
+class _IterableReader:
+    """Minimal readinto() over an iterable of bytes-like blocks"""
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._pending = memoryview(b"")
+
+    def readinto(self, buffer):
+        while not self._pending:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._pending = memoryview(block).cast("B")
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+
+def _read_chunks(source, size):
+    """Yield (chunk, final) memoryviews of up to size bytes from a file-like object or iterable
+
+    Two buffers are reused in turn, so a chunk is only valid until the next one is requested.
+    """
+    if not hasattr(source, 'readinto'):
+        source = _IterableReader(source)
+    views = (memoryview(bytearray(size)), memoryview(bytearray(size)))
+
+    def fill(view):
+        filled = 0
+        while filled < size:
+            count = source.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        return filled
+
+    current = 0
+    filled = fill(views[current])
+    while True:
+        # A full chunk is only the last one if nothing follows it
+        following = fill(views[current ^ 1]) if filled == size else 0
+        yield views[current][:filled], following == 0
+        if following == 0:
+            return
+        current ^= 1
+        filled = following
+
 # Simulate Signal's double ratchet approach with Kyber for quantum resistance
 class SignalStyleSession:
+    __slots__ = ('person', 'current_sending_key', 'current_receiving_key', 'message_number', '_aeads')
+
+    # Attachment streams: plaintext bytes per chunk, and the header
+    # nonce prefix (8) || message number (4) || chunk size (4)
+    STREAM_CHUNK_SIZE = 64 * 1024
+    STREAM_HEADER_SIZE = 16
+    # The chunk size is read from the header before anything is authenticated,
+    # so decrypt_stream refuses larger ones instead of allocating for them
+    MAX_STREAM_CHUNK_SIZE = 1024 * 1024
+    
+    # AEAD objects kept per session: current sending and receiving chains plus the previous pair
+    MAX_CACHED_KEYS = 4
+
     def __init__(self, person):
         self.person = person
-        self.message_keys = {}
         self.current_sending_key = None
         self.current_receiving_key = None
         self.message_number = 0
+        self._aeads = {}
     
-    def derive_message_key(self, shared_secret, message_number):
-        """Derive a message key from shared secret and message number"""
-        key_material = shared_secret + message_number.to_bytes(4, byteorder='big')
-        return hashlib.sha256(key_material).digest()
+    def _aead(self, chain_key):
+        """AES-256-GCM object for a chain key, derived with HKDF once and then reused"""
+        aead = self._aeads.get(chain_key)
+        if aead is None:
+            if len(self._aeads) >= self.MAX_CACHED_KEYS:
+                self._aeads.clear()
+            key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                       info=b"SignalStyleSession message key").derive(chain_key)
+            aead = self._aeads[chain_key] = AESGCM(key)
+        return aead
     
     def encrypt_message(self, message, recipient_session):
         """Encrypt a message for a recipient using the double ratchet protocol"""
@@ -292,60 +342,93 @@ class SignalStyleSession:
         if not self.current_sending_key:
             raise ValueError("No sending key established")
         
-        # Derive a message key
-        message_key = self.derive_message_key(self.current_sending_key, self.message_number)
+        # GCM needs no padding; the tag is appended to the ciphertext and the
+        # message number is authenticated as associated data
+        message_number = self.message_number
+        iv = os.urandom(12)
+        ciphertext = self._aead(self.current_sending_key).encrypt(
+            iv, message.encode(), message_number.to_bytes(4, byteorder='big'))
         
-        # Encrypt the message
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(message.encode()) + padder.finalize()
-        
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(message_key), modes.GCM(iv), 
-                       backend=default_backend())
-        encryptor = cipher.encryptor()
-        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
+        # Increment the message number
+        self.message_number += 1
         
-        encrypted = {
-            'iv': iv,
-            'ciphertext': ciphertext,
-            'tag': encryptor.tag,
-            'message_number': self.message_number
-        }
+        return {'iv': iv, 'ciphertext': ciphertext, 'message_number': message_number}
+    
+    def encrypt_stream(self, source, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt a file-like object or iterable of bytes chunk by chunk, yielding the header then each chunk
+
+        Memory stays at two plaintext chunks however large the attachment is.
+        """
+        if not self.current_sending_key:
+            raise ValueError("No sending key established")
+        if not 0 < chunk_size <= self.MAX_STREAM_CHUNK_SIZE:
+            raise ValueError("chunk_size must be between 1 and MAX_STREAM_CHUNK_SIZE")
         
-        # Increment the message number
+        aead = self._aead(self.current_sending_key)
+        message_number = self.message_number
         self.message_number += 1
         
-        return encrypted
+        prefix = os.urandom(8)
+        header = prefix + message_number.to_bytes(4, byteorder='big') + chunk_size.to_bytes(4, byteorder='big')
+        yield header
+        
+        # nonce = prefix || chunk index; the associated data is the whole header
+        # plus a last-chunk flag, so that altering the header or dropping,
+        # reordering or truncating chunks fails authentication
+        for index, (chunk, final) in enumerate(_read_chunks(source, chunk_size)):
+            if index >= 2 ** 32:
+                raise ValueError("Too many chunks for one stream")
+            nonce = prefix + index.to_bytes(4, byteorder='big')
+            yield aead.encrypt(nonce, chunk, header + (b"\x01" if final else b"\x00"))
+    
+    def decrypt_stream(self, source):
+        """Decrypt the output of encrypt_stream from a file-like object or iterable, yielding plaintext chunks
+
+        Each chunk is authenticated before it is yielded, but a truncated stream is only
+        detected at the end: discard the output if InvalidTag is raised at any point.
+        """
+        if not self.current_receiving_key:
+            raise ValueError("No receiving key established")
+        
+        if not hasattr(source, 'readinto'):
+            source = _IterableReader(source)
+        header = bytearray(self.STREAM_HEADER_SIZE)
+        view = memoryview(header)
+        filled = 0
+        while filled < len(header):
+            count = source.readinto(view[filled:])
+            if not count:
+                raise ValueError("Truncated stream header")
+            filled += count
+        header = bytes(header)
+        prefix = header[:8]
+        chunk_size = int.from_bytes(header[12:], byteorder='big')
+        if not 0 < chunk_size <= self.MAX_STREAM_CHUNK_SIZE:
+            raise ValueError("Invalid stream header")
+        
+        aead = self._aead(self.current_receiving_key)
+        # Every encrypted chunk carries a 16-byte GCM tag
+        for index, (chunk, final) in enumerate(_read_chunks(source, chunk_size + 16)):
+            nonce = prefix + index.to_bytes(4, byteorder='big')
+            yield aead.decrypt(nonce, chunk, header + (b"\x01" if final else b"\x00"))
     
     def decrypt_message(self, encrypted_data):
         """Decrypt a message using the double ratchet protocol"""
-        # Get the message number
-        message_number = encrypted_data['message_number']
-        
-        # Derive the message key
         if not self.current_receiving_key:
             raise ValueError("No receiving key established")
         
-        message_key = self.derive_message_key(self.current_receiving_key, message_number)
-        
-        # Decrypt the message
-        iv = encrypted_data['iv']
-        ciphertext = encrypted_data['ciphertext']
-        tag = encrypted_data['tag']
-        
-        cipher = Cipher(algorithms.AES(message_key), modes.GCM(iv, tag), 
-                       backend=default_backend())
-        decryptor = cipher.decryptor()
-        padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-        
-        # Unpad the message
-        unpadder = padding.PKCS7(128).unpadder()
-        plaintext = unpadder.update(padded_plaintext) + unpadder.finalize()
+        # Raises cryptography.exceptions.InvalidTag if anything was tampered with
+        message_number = encrypted_data['message_number']
+        plaintext = self._aead(self.current_receiving_key).decrypt(
+            encrypted_data['iv'], encrypted_data['ciphertext'], message_number.to_bytes(4, byteorder='big'))
         
         return plaintext.decode()
 
 # Demonstration
 if __name__ == "__main__":
+    # Show the KEM progress messages in order with the demo output
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    logger.setLevel(logging.DEBUG)
     print("Initializing quantum-resistant Signal-style communication...")
     
     # Create Alice and Bob
@@ -360,6 +443,11 @@ if __name__ == "__main__":
     # Alice encapsulates a shared secret to Bob
     ciphertext = alice.encapsulate(bob_public_key)
     
+    # Sizes on the wire
+    bob_seed, bob_t = bob_public_key
+    print(f"Bob's public key: {len(serialize.encode_public_key(bob_t, bob_seed))} bytes")
+    print(f"Ciphertext: {len(serialize.encode_ciphertext(*ciphertext, bob.params.du, bob.params.dv))} bytes")
+    
     # Bob decapsulates to get the same shared secret
     bob.decapsulate(ciphertext)
     
@@ -397,4 +485,10 @@ if __name__ == "__main__":
     
     # Alice decrypts Bob's response
     decrypted_response = alice_session.decrypt_message(encrypted_response)
-    print(f"Alice decrypted: {decrypted_response}")
\ No newline at end of file
+    print(f"Alice decrypted: {decrypted_response}")    
+    # Large attachments are encrypted chunk by chunk without loading them whole
+    attachment = os.urandom(1024 * 1024)
+    encrypted_attachment = b"".join(alice_session.encrypt_stream(io.BytesIO(attachment)))
+    received = b"".join(bob_session.decrypt_stream(io.BytesIO(encrypted_attachment)))
+    print(f"Attachment of {len(attachment)} bytes sent as {len(encrypted_attachment)} bytes, "
+          f"intact: {received == attachment}")
@@ -0,0 +1,207 @@
+import itertools
+from collections import namedtuple
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+import double_rachet
+from test import Kyber
+
+# PQXDH key agreement (Signal specification, revision 2) with X25519 and the
+# Kyber-768 KEM from test.py, plus the classical X3DH handshake it extends.
+#
+# The four DH outputs and the KEM shared secret are concatenated and go
+# through a single HKDF. With an executor, the KEM operation and the DH
+# computations are submitted together and run concurrently.
+#
+# The spec signs prekeys with the identity key itself via XEdDSA; cryptography
+# has no XEdDSA, so each identity also has an Ed25519 key that signs them.
+# That key arrives in the same unauthenticated bundle as the prekeys, so it is
+# bound to the identity through the associated data, IKA || SigA || IKB || SigB:
+# a substituted signing key changes the identity the two parties authenticate.
+
+PQXDH_INFO = b"PQXDH_CURVE25519_SHA-256_CRYSTALS-KYBER-768"
+X3DH_INFO = b"X3DH_CURVE25519_SHA-256"
+F = b"\xff" * 32  # Prepended to the KDF input for X25519
+LAST_RESORT_PQ_PREKEY_ID = 0
+
+PrekeyBundle = namedtuple('PrekeyBundle', [
+    'identity_key', 'signing_key',
+    'signed_prekey', 'signed_prekey_signature',
+    'pq_prekey', 'pq_prekey_signature', 'pq_prekey_id',
+    'one_time_prekey', 'one_time_prekey_id'])
+
+InitialMessage = namedtuple('InitialMessage', [
+    'identity_key', 'signing_key', 'ephemeral_key', 'pq_ciphertext', 'pq_prekey_id', 'one_time_prekey_id'])
+
+def _public_bytes(private):
+    return private.public_key().public_bytes_raw()
+
+def encode_kem_public_key(public_key):
+    """Wire encoding of a Kyber public key (t || rho), as signed in the bundle"""
+    return public_key['t'] + public_key['rho']
+
+def _exchange(pair):
+    private, public = pair
+    return private.exchange(X25519PublicKey.from_public_bytes(public))
+
+def _kdf(key_material, info):
+    """HKDF-SHA256 over F || KM with a zero salt, 32 bytes out"""
+    return double_rachet.HKDF(bytes(32), F + key_material, info, 32)
+
+class User:
+    """Long-term identity and the prekeys one party publishes"""
+    def __init__(self, name, kem=None):
+        self.name = name
+        self.kem = kem or Kyber()
+        self.identity = X25519PrivateKey.generate()
+        self.identity_public = _public_bytes(self.identity)
+        self.signing = Ed25519PrivateKey.generate()
+        self.signing_public = self.signing.public_key().public_bytes_raw()
+
+        self.signed_prekey = X25519PrivateKey.generate()
+        self.signed_prekey_public = _public_bytes(self.signed_prekey)
+        self.signed_prekey_signature = self.signing.sign(self.signed_prekey_public)
+
+        # Last-resort KEM prekey, used when no one-time KEM prekey is left
+        self.pq_prekey_public, self.pq_prekey_secret = self.kem.keygen()
+        self.pq_prekey_signature = self.signing.sign(encode_kem_public_key(self.pq_prekey_public))
+
+        self.one_time_prekeys = {}  # id -> X25519 private key
+        self.one_time_pq_prekeys = {}  # id -> Kyber secret key
+        self._ids = itertools.count(1)
+
+    def add_one_time_prekeys(self, count):
+        """Generate count one-time X25519 prekeys; returns their (id, public key) pairs"""
+        published = []
+        for _ in range(count):
+            prekey_id = next(self._ids)
+            private = X25519PrivateKey.generate()
+            self.one_time_prekeys[prekey_id] = private
+            published.append((prekey_id, _public_bytes(private)))
+        return published
+
+    def add_one_time_pq_prekeys(self, count):
+        """Generate count signed one-time KEM prekeys; returns (id, public key, signature) triples"""
+        public_keys, secret_keys = self.kem.keygen_batch(count)
+        published = []
+        for public_key, secret_key in zip(public_keys, secret_keys):
+            prekey_id = next(self._ids)
+            self.one_time_pq_prekeys[prekey_id] = secret_key
+            published.append((prekey_id, public_key, self.signing.sign(encode_kem_public_key(public_key))))
+        return published
+
+    def bundle(self, one_time_prekey=None):
+        """Prekey bundle with the last-resort KEM prekey and, optionally, an (id, public key) one-time prekey"""
+        one_time_id, one_time_public = one_time_prekey or (None, None)
+        return PrekeyBundle(self.identity_public, self.signing_public,
+                            self.signed_prekey_public, self.signed_prekey_signature,
+                            self.pq_prekey_public, self.pq_prekey_signature, LAST_RESORT_PQ_PREKEY_ID,
+                            one_time_public, one_time_id)
+
+def verify_bundle(bundle, post_quantum=True):
+    """Check the prekey signatures; raises ValueError if one does not verify"""
+    signing_key = Ed25519PublicKey.from_public_bytes(bundle.signing_key)
+    try:
+        signing_key.verify(bundle.signed_prekey_signature, bundle.signed_prekey)
+        if post_quantum:
+            signing_key.verify(bundle.pq_prekey_signature, encode_kem_public_key(bundle.pq_prekey))
+    except InvalidSignature:
+        raise ValueError("Invalid prekey signature")
+
+def initiate(sender, bundle, executor=None, post_quantum=True):
+    """Sender side: returns (SK, AD, InitialMessage) for the recipient's bundle
+
+    post_quantum=False runs classical X3DH (no KEM prekey needed).
+    """
+    verify_bundle(bundle, post_quantum)
+    ephemeral = X25519PrivateKey.generate()
+
+    # DH1 = DH(IKA, SPKB), DH2 = DH(EKA, IKB), DH3 = DH(EKA, SPKB), DH4 = DH(EKA, OPKB)
+    pairs = [(sender.identity, bundle.signed_prekey), (ephemeral, bundle.identity_key),
+             (ephemeral, bundle.signed_prekey)]
+    if bundle.one_time_prekey is not None:
+        pairs.append((ephemeral, bundle.one_time_prekey))
+
+    ciphertext = shared_secret = None
+    if executor is None:
+        dhs = [_exchange(pair) for pair in pairs]
+        if post_quantum:
+            ciphertext, shared_secret = sender.kem.encaps(bundle.pq_prekey)
+    else:
+        # The KEM goes first: it is the longest of the independent computations
+        kem = executor.submit(sender.kem.encaps, bundle.pq_prekey) if post_quantum else None
+        dhs = list(executor.map(_exchange, pairs))
+        if kem is not None:
+            ciphertext, shared_secret = kem.result()
+
+    if post_quantum:
+        SK = _kdf(b"".join(dhs) + shared_secret, PQXDH_INFO)
+    else:
+        SK = _kdf(b"".join(dhs), X3DH_INFO)
+    AD = sender.identity_public + sender.signing_public + bundle.identity_key + bundle.signing_key
+    message = InitialMessage(sender.identity_public, sender.signing_public, _public_bytes(ephemeral), ciphertext,
+                             bundle.pq_prekey_id if post_quantum else None, bundle.one_time_prekey_id)
+    return SK, AD, message
+
+def respond(recipient, message, executor=None):
+    """Recipient side: returns (SK, AD) for an InitialMessage, consuming the one-time prekeys it names"""
+    pairs = [(recipient.signed_prekey, message.identity_key), (recipient.identity, message.ephemeral_key),
+             (recipient.signed_prekey, message.ephemeral_key)]
+    # Both prekey ids are checked before either key is removed, so a bad
+    # message cannot use up a one-time prekey meant for the real one
+    one_time_id = message.one_time_prekey_id
+    if one_time_id is not None and one_time_id not in recipient.one_time_prekeys:
+        raise ValueError("Unknown or already used one-time prekey")
+    post_quantum = message.pq_ciphertext is not None
+    one_time_pq_id = None
+    if post_quantum and message.pq_prekey_id != LAST_RESORT_PQ_PREKEY_ID:
+        one_time_pq_id = message.pq_prekey_id
+        if one_time_pq_id not in recipient.one_time_pq_prekeys:
+            raise ValueError("Unknown or already used one-time KEM prekey")
+
+    if one_time_id is not None:
+        pairs.append((recipient.one_time_prekeys.pop(one_time_id), message.ephemeral_key))
+    if post_quantum:
+        if one_time_pq_id is None:
+            pq_secret = recipient.pq_prekey_secret
+        else:
+            pq_secret = recipient.one_time_pq_prekeys.pop(one_time_pq_id)
+
+    shared_secret = None
+    if executor is None:
+        dhs = [_exchange(pair) for pair in pairs]
+        if post_quantum:
+            shared_secret = recipient.kem.decaps(message.pq_ciphertext, pq_secret)
+    else:
+        kem = executor.submit(recipient.kem.decaps, message.pq_ciphertext, pq_secret) if post_quantum else None
+        dhs = list(executor.map(_exchange, pairs))
+        if kem is not None:
+            shared_secret = kem.result()
+
+    if post_quantum:
+        SK = _kdf(b"".join(dhs) + shared_secret, PQXDH_INFO)
+    else:
+        SK = _kdf(b"".join(dhs), X3DH_INFO)
+    return SK, message.identity_key + message.signing_key + recipient.identity_public + recipient.signing_public
+
+if __name__ == "__main__":
+    alice = User("Alice")
+    bob = User("Bob")
+    bundle = bob.bundle(bob.add_one_time_prekeys(1)[0])
+
+    alice_sk, alice_ad, message = initiate(alice, bundle)
+    bob_sk, bob_ad = respond(bob, message)
+    print(f"PQXDH shared secrets match: {alice_sk == bob_sk and alice_ad == bob_ad}")
+
+    # The shared secret starts a double ratchet with Bob's signed prekey as his first ratchet key
+    alice_state, bob_state = double_rachet.RatchetState(), double_rachet.RatchetState()
+    double_rachet.RatchetInitAlice(alice_state, alice_sk, bundle.signed_prekey)
+    double_rachet.RatchetInitBob(bob_state, bob_sk,
+                                 double_rachet.DHKeyPair(bob.signed_prekey, bob.signed_prekey_public))
+    header, ciphertext = alice_state.encrypt(b"Hello Bob, this is the first ratchet message", alice_ad)
+    print(f"Bob decrypted: {bob_state.decrypt(header, ciphertext, bob_ad).decode()}")
+
+    try:
+        respond(bob, message)
+    except ValueError as e:
+        print(f"Replayed initial message rejected: {e}")
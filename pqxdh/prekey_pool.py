@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from test import Kyber, KyberParameters
+
+_FAILED = object()  # Queued when a chunk fails, to wake threads blocked in get()
+
+def _generate_chunk(k, count):
+    """Worker entry point: generate count key pairs in a child process"""
+    public_keys, secret_keys = Kyber(KyberParameters(k)).keygen_batch(count)
+    return list(zip(public_keys, secret_keys))
+
+class PrekeyPool:
+    """Pool of ready one-time Kyber prekeys, refilled by a process pool"""
+    def __init__(self, params=None, workers=None, capacity=1000, low_water=250, chunk_size=50):
+        if not 0 <= low_water < capacity:
+            raise ValueError("low_water must be between 0 and capacity")
+        self.params = params or KyberParameters()
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = capacity
+        self.low_water = low_water
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=capacity)
+        self._in_flight = 0  # Keys submitted to workers but not yet queued
+        self._stopped = False
+        self._error = None  # Exception of the first failed chunk; get() raises it
+        # Re-entrant: a chunk that is already done runs its callback inside submit
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def start(self):
+        """Start the worker processes and fill the pool up to capacity"""
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._refill()
+        return self
+
+    def stop(self):
+        """Stop refilling and shut the worker processes down"""
+        with self._lock:
+            self._stopped = True
+        if self._executor:
+            self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def get(self, timeout=None):
+        """Take one (public_key, secret_key) pair, blocking until one is ready
+
+        Raises RuntimeError once the pool has run out of keys after a worker
+        failed (an exception in key generation or a broken process pool).
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is _FAILED:
+            # Put it back for the next caller, so every waiting thread wakes up
+            self._queue.put_nowait(_FAILED)
+            raise RuntimeError("Prekey generation failed") from self._error
+        if self._queue.qsize() <= self.low_water:
+            self._refill()
+        return item
+
+    def get_many(self, count, timeout=None):
+        """Take count key pairs"""
+        return [self.get(timeout) for _ in range(count)]
+
+    def _refill(self):
+        """Fan the keys missing up to capacity out across the workers in chunks"""
+        with self._lock:
+            if self._stopped or self._error is not None:
+                return
+            missing = self.capacity - self._queue.qsize() - self._in_flight
+            for start in range(0, missing, self.chunk_size):
+                count = min(self.chunk_size, missing - start)
+                self._in_flight += count
+                future = self._executor.submit(_generate_chunk, self.params.k, count)
+                future.add_done_callback(partial(self._chunk_done, count))
+
+    def _chunk_done(self, count, future):
+        """Stream a finished chunk into the queue as soon as its worker returns"""
+        with self._lock:
+            self._in_flight -= count
+            if self._stopped or future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                # No more refills; get() hands out what is queued, then raises
+                if self._error is None:
+                    self._error = error
+                    self._queue.put_nowait(_FAILED)
+                return
+            # queued + in-flight never exceeds capacity, so this cannot block
+            for item in future.result():
+                self._queue.put_nowait(item)
+
+if __name__ == "__main__":
+    with PrekeyPool(capacity=200, low_water=50) as pool:
+        public_key, secret_key = pool.get()
+        print(f"Got a prekey from a pool of {pool.capacity} with {pool.workers} workers")
+        print(f"Prekey seed: {public_key['rho'].hex()[:16]}...")
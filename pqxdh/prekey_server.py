@@ -0,0 +1,236 @@
+import argparse
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+import pqxdh_handshake
+from pqxdh_handshake import LAST_RESORT_PQ_PREKEY_ID, PrekeyBundle
+
+# In-process stand-in for the key distribution server.
+#
+# Each (user, device) has one record in a dict. One-time X25519 prekeys are
+# packed into a bytearray as 4-byte id || 32-byte key entries with a read
+# offset, so a device with a hundred prekeys costs a few kilobytes and taking
+# one is O(1). Records are spread over striped locks: a fetch takes exactly one
+# prekey of each kind atomically without serializing unrelated devices.
+
+ONE_TIME_ENTRY = 36  # id (4) || X25519 public key (32)
+LOCK_STRIPES = 64
+
+class _Device:
+    """Published keys of one device"""
+    __slots__ = ('identity_key', 'signing_key', 'signed_prekey', 'signed_prekey_signature',
+                 'pq_prekey', 'pq_prekey_signature', 'one_time', 'one_time_offset', 'one_time_pq')
+
+    def __init__(self, identity_key, signing_key, signed_prekey, signed_prekey_signature,
+                 pq_prekey, pq_prekey_signature):
+        self.identity_key = identity_key
+        self.signing_key = signing_key
+        self.signed_prekey = signed_prekey
+        self.signed_prekey_signature = signed_prekey_signature
+        self.pq_prekey = pq_prekey
+        self.pq_prekey_signature = pq_prekey_signature
+        self.one_time = bytearray()
+        self.one_time_offset = 0
+        self.one_time_pq = deque()  # (id, public key, signature)
+
+    def one_time_count(self):
+        return (len(self.one_time) - self.one_time_offset) // ONE_TIME_ENTRY
+
+    def take_one_time(self):
+        """Pop the oldest one-time prekey as (id, public key), or (None, None)"""
+        offset = self.one_time_offset
+        if offset == len(self.one_time):
+            return None, None
+        entry = bytes(self.one_time[offset:offset + ONE_TIME_ENTRY])
+        offset += ONE_TIME_ENTRY
+        if offset == len(self.one_time):
+            self.one_time = bytearray()
+            offset = 0
+        elif offset > len(self.one_time) // 2:
+            # Drop the consumed half so the buffer doesn't keep growing
+            del self.one_time[:offset]
+            offset = 0
+        self.one_time_offset = offset
+        return int.from_bytes(entry[:4], 'big'), entry[4:]
+
+class PrekeyServer:
+    """Stores prekey bundles per (user, device) and hands out one-time prekeys exactly once"""
+    def __init__(self, low_water=10, on_low=None):
+        self._devices = {}  # (user id, device id) -> _Device
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # on_low(user_id, device_id, remaining) is called when a fetch leaves
+        # a device with low_water one-time prekeys, so the client can upload more
+        self.low_water = low_water
+        self.on_low = on_low
+        # Counters per lock stripe, each only updated under its own lock
+        self._fetches = [0] * LOCK_STRIPES
+        self._exhausted = [0] * LOCK_STRIPES
+        self._pq_last_resort = [0] * LOCK_STRIPES
+
+    @property
+    def fetches(self):
+        """Bundles handed out"""
+        return sum(self._fetches)
+
+    @property
+    def exhausted(self):
+        """Fetches that found no one-time X25519 prekey"""
+        return sum(self._exhausted)
+
+    @property
+    def pq_last_resort(self):
+        """Fetches that fell back to the last-resort KEM prekey"""
+        return sum(self._pq_last_resort)
+
+    def _stripe(self, key):
+        return hash(key) % LOCK_STRIPES
+
+    def _lock(self, key):
+        return self._locks[self._stripe(key)]
+
+    def register(self, user_id, device_id, identity_key, signing_key, signed_prekey,
+                 signed_prekey_signature, pq_prekey, pq_prekey_signature):
+        """Publish (or replace) a device's identity, signed prekey and last-resort KEM prekey"""
+        key = (user_id, device_id)
+        device = _Device(identity_key, signing_key, signed_prekey, signed_prekey_signature,
+                         pq_prekey, pq_prekey_signature)
+        with self._lock(key):
+            previous = self._devices.get(key)
+            if previous is not None:
+                # A new signed prekey doesn't invalidate one-time prekeys already uploaded
+                device.one_time, device.one_time_offset = previous.one_time, previous.one_time_offset
+                device.one_time_pq = previous.one_time_pq
+            self._devices[key] = device
+
+    def _device(self, key):
+        device = self._devices.get(key)
+        if device is None:
+            raise ValueError("Unknown user or device")
+        return device
+
+    def upload_one_time_prekeys(self, user_id, device_id, prekeys):
+        """Bulk upload of (id, 32-byte public key) one-time X25519 prekeys"""
+        packed = bytearray()
+        for prekey_id, public_key in prekeys:
+            if len(public_key) != 32:
+                raise ValueError("One-time prekeys must be 32-byte X25519 public keys")
+            packed += prekey_id.to_bytes(4, 'big')
+            packed += public_key
+        key = (user_id, device_id)
+        with self._lock(key):
+            self._device(key).one_time += packed
+
+    def upload_one_time_pq_prekeys(self, user_id, device_id, prekeys):
+        """Bulk upload of (id, KEM public key, signature) one-time KEM prekeys"""
+        key = (user_id, device_id)
+        with self._lock(key):
+            self._device(key).one_time_pq.extend(prekeys)
+
+    def publish(self, user_id, device_id, user, one_time=100, one_time_pq=10):
+        """Register a pqxdh_handshake.User and upload freshly generated one-time prekeys for it"""
+        self.register(user_id, device_id, user.identity_public, user.signing_public,
+                      user.signed_prekey_public, user.signed_prekey_signature,
+                      user.pq_prekey_public, user.pq_prekey_signature)
+        if one_time:
+            self.upload_one_time_prekeys(user_id, device_id, user.add_one_time_prekeys(one_time))
+        if one_time_pq:
+            self.upload_one_time_pq_prekeys(user_id, device_id, user.add_one_time_pq_prekeys(one_time_pq))
+
+    def fetch_bundle(self, user_id, device_id):
+        """PrekeyBundle for a device, consuming one one-time prekey of each kind if any are left"""
+        key = (user_id, device_id)
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            device = self._device(key)
+            one_time_id, one_time_key = device.take_one_time()
+            if device.one_time_pq:
+                pq_id, pq_prekey, pq_signature = device.one_time_pq.popleft()
+            else:
+                pq_id, pq_prekey, pq_signature = LAST_RESORT_PQ_PREKEY_ID, device.pq_prekey, device.pq_prekey_signature
+            remaining = device.one_time_count()
+            self._fetches[stripe] += 1
+            if one_time_id is None:
+                self._exhausted[stripe] += 1
+            if pq_id == LAST_RESORT_PQ_PREKEY_ID:
+                self._pq_last_resort[stripe] += 1
+            bundle = PrekeyBundle(device.identity_key, device.signing_key,
+                                  device.signed_prekey, device.signed_prekey_signature,
+                                  pq_prekey, pq_signature, pq_id, one_time_key, one_time_id)
+        if self.on_low is not None and one_time_id is not None and remaining == self.low_water:
+            self.on_low(user_id, device_id, remaining)
+        return bundle
+
+    def one_time_counts(self, user_id, device_id):
+        """(one-time X25519 prekeys, one-time KEM prekeys) left for a device"""
+        key = (user_id, device_id)
+        with self._lock(key):
+            device = self._device(key)
+            return device.one_time_count(), len(device.one_time_pq)
+
+    def __len__(self):
+        return len(self._devices)
+
+def populate(server, users, one_time=20):
+    """Register devices 0..users-1 of server, all publishing copies of one user's keys"""
+    # Generating real key pairs per user would dominate the run; the server only
+    # stores bytes, so every device can publish the same ones
+    template = pqxdh_handshake.User("Template")
+    one_time_keys = template.add_one_time_prekeys(one_time)
+    for user_id in range(users):
+        server.register(user_id, 1, template.identity_public, template.signing_public,
+                        template.signed_prekey_public, template.signed_prekey_signature,
+                        template.pq_prekey_public, template.pq_prekey_signature)
+        server.upload_one_time_prekeys(user_id, 1, one_time_keys)
+    return server
+
+def load_test(users, one_time=20, fetches=200_000, seed=0):
+    """Register users devices with populate(), then fetch bundles for random devices"""
+    rng = random.Random(seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    server = populate(PrekeyServer(), users, one_time)
+    register_time = time.perf_counter() - start
+    bytes_per_device = (tracemalloc.get_traced_memory()[0] - before) / users
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(fetches):
+        server.fetch_bundle(rng.randrange(users), 1)
+    fetch_time = time.perf_counter() - start
+
+    # Drain one device to show what exhaustion looks like
+    for _ in range(one_time + 5):
+        bundle = server.fetch_bundle(0, 1)
+    return {
+        'devices': len(server),
+        'registrations_per_sec': users / register_time,
+        'bytes_per_device': bytes_per_device,
+        'fetches_per_sec': fetches / fetch_time,
+        'exhausted_fetches': server.exhausted,
+        'last_resort_pq_fetches': server.pq_last_resort,
+        'drained_bundle_has_one_time_prekey': bundle.one_time_prekey is not None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prekey bundle server load test")
+    parser.add_argument("--users", type=int, default=100_000, help="registered devices")
+    parser.add_argument("--one-time", type=int, default=20, help="one-time prekeys uploaded per device")
+    parser.add_argument("--fetches", type=int, default=200_000, help="random bundle fetches")
+    args = parser.parse_args()
+
+    # Round trip through the server for a real handshake first
+    server = PrekeyServer()
+    alice, bob = pqxdh_handshake.User("Alice"), pqxdh_handshake.User("Bob")
+    server.publish("bob", 1, bob, one_time=5, one_time_pq=1)
+    bundle = server.fetch_bundle("bob", 1)
+    alice_sk, _, message = pqxdh_handshake.initiate(alice, bundle)
+    bob_sk, _ = pqxdh_handshake.respond(bob, message)
+    print(f"Handshake through the server: shared secrets match: {alice_sk == bob_sk}")
+    print(f"Bob's one-time prekeys left (X25519, KEM): {server.one_time_counts('bob', 1)}")
+
+    result = load_test(args.users, args.one_time, args.fetches)
+    for name, value in result.items():
+        print(f"{name:<36} {value:,.1f}" if isinstance(value, float) else f"{name:<36} {value}")
@@ -0,0 +1,110 @@
+import numpy as np
+import ntt
+
+# Polynomial arithmetic backends for Z_q[X]/(X^n + 1).
+# All backends take and return polynomials in normal (coefficient) form and
+# wrap negacyclically (x^n = -1), so they are interchangeable.
+
+class NTTBackend:
+    """Ring arithmetic through the number-theoretic transform (Kyber q and n only)"""
+    name = "ntt"
+
+    def __init__(self, q=ntt.Q, n=ntt.N):
+        if q != ntt.Q or n != ntt.N:
+            raise ValueError("NTT backend requires q = 3329 and n = 256")
+        self.q = q
+        self.n = n
+
+    def matvec(self, matrix, vector):
+        """Matrix-vector product A·v"""
+        return ntt.inv_ntt(ntt.matvec(ntt.ntt(matrix), ntt.ntt(vector)))
+
+    def dot(self, vec1, vec2):
+        """Inner product vec1^T·vec2"""
+        return ntt.inv_ntt(ntt.dot(ntt.ntt(vec1), ntt.ntt(vec2)))
+
+class ConvolutionBackend:
+    """Ring arithmetic through NumPy convolution (any q and n)"""
+    name = "convolution"
+
+    def __init__(self, q, n):
+        self.q = q
+        self.n = n
+
+    def _poly_mul(self, a, b):
+        """Negacyclic product of two polynomials"""
+        full = np.convolve(a, b)
+        result = full[:self.n].copy()
+        result[:self.n - 1] -= full[self.n:]
+        return result % self.q
+
+    def matvec(self, matrix, vector):
+        """Matrix-vector product A·v"""
+        matrix = np.asarray(matrix, dtype=np.int64) % self.q
+        vector = np.asarray(vector, dtype=np.int64) % self.q
+        result = np.zeros(vector.shape, dtype=np.int64)
+        for i in range(matrix.shape[0]):
+            for j in range(matrix.shape[1]):
+                result[i] += self._poly_mul(matrix[i][j], vector[j])
+        return result % self.q
+
+    def dot(self, vec1, vec2):
+        """Inner product vec1^T·vec2"""
+        vec1 = np.asarray(vec1, dtype=np.int64) % self.q
+        vec2 = np.asarray(vec2, dtype=np.int64) % self.q
+        result = np.zeros(self.n, dtype=np.int64)
+        for i in range(vec1.shape[0]):
+            result += self._poly_mul(vec1[i], vec2[i])
+        return result % self.q
+
+class SchoolbookBackend:
+    """Pure-Python nested loops, kept as a reference and benchmark baseline"""
+    name = "schoolbook"
+
+    def __init__(self, q, n):
+        self.q = q
+        self.n = n
+
+    def _poly_mul_add(self, acc, a, b):
+        """acc += a·b in the ring"""
+        n = self.n
+        q = self.q
+        for l in range(n):
+            for m in range(n):
+                idx = l + m
+                if idx < n:
+                    acc[idx] = (acc[idx] + a[l] * b[m]) % q
+                else:
+                    # x^n = -1
+                    acc[idx - n] = (acc[idx - n] - a[l] * b[m]) % q
+
+    def matvec(self, matrix, vector):
+        """Matrix-vector product A·v"""
+        result = []
+        for i in range(len(matrix)):
+            row_result = [0] * self.n
+            for j in range(len(vector)):
+                self._poly_mul_add(row_result, [int(c) for c in matrix[i][j]], [int(c) for c in vector[j]])
+            result.append(row_result)
+        return np.array(result, dtype=np.int64)
+
+    def dot(self, vec1, vec2):
+        """Inner product vec1^T·vec2"""
+        result = [0] * self.n
+        for i in range(len(vec1)):
+            self._poly_mul_add(result, [int(c) for c in vec1[i]], [int(c) for c in vec2[i]])
+        return np.array(result, dtype=np.int64)
+
+BACKENDS = {
+    NTTBackend.name: NTTBackend,
+    ConvolutionBackend.name: ConvolutionBackend,
+    SchoolbookBackend.name: SchoolbookBackend,
+}
+
+def get_backend(params, name=None):
+    """Pick a ring backend for the given parameters (NTT when possible)"""
+    if name is None:
+        name = NTTBackend.name if (params.q, params.n) == (ntt.Q, ntt.N) else ConvolutionBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown ring backend: {name}")
+    return BACKENDS[name](params.q, params.n)
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+N = 256
+Q = 3329
+XOF_BLOCK = 168  # SHAKE-128 rate in bytes
+
+def sample_ntt(xof_input, n=N, q=Q):
+    """Rejection-sample n uniform coefficients mod q from SHAKE-128(xof_input)"""
+    xof = hashlib.shake_128(xof_input)
+    # Three blocks cover 256 coefficients with overwhelming probability;
+    # SHAKE output is a prefix stream, so asking for more just extends it
+    length = 3 * XOF_BLOCK
+    while True:
+        b = np.frombuffer(xof.digest(length), dtype=np.uint8).reshape(-1, 3).astype(np.uint16)
+        # Each 3 bytes give two 12-bit candidates d1, d2
+        candidates = np.empty((b.shape[0], 2), dtype=np.uint16)
+        candidates[:, 0] = b[:, 0] | ((b[:, 1] & 0x0F) << 8)
+        candidates[:, 1] = (b[:, 1] >> 4) | (b[:, 2] << 4)
+        accepted = candidates.reshape(-1)
+        accepted = accepted[accepted < q]
+        if accepted.size >= n:
+            return accepted[:n]
+        length += XOF_BLOCK
+
+def expand_a(rho, k, n=N, q=Q):
+    """Expand the k×k public matrix A from a 32-byte seed"""
+    A = np.empty((k, k, n), dtype=np.uint16)
+    for i in range(k):
+        for j in range(k):
+            # Domain separation per entry: rho || j || i
+            A[i, j] = sample_ntt(rho + bytes([j, i]), n, q)
+    return A
+
+def prf(seed, nonce, length):
+    """Pseudorandom bytes SHAKE-256(seed || nonce)"""
+    return hashlib.shake_256(seed + bytes([nonce])).digest(length)
+
+def cbd_from_bytes(data, eta):
+    """Centered binomial samples from 2·eta bits each: popcount(a) - popcount(b)"""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little").reshape(-1, 2 * eta)
+    return bits[:, :eta].sum(axis=1, dtype=np.int16) - bits[:, eta:].sum(axis=1, dtype=np.int16)
+
+class MatrixCache:
+    """LRU cache of expanded matrices keyed by seed, bounded by total bytes"""
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, rho, k, n=N, q=Q):
+        """Return the (read-only) matrix for rho, expanding it on a miss"""
+        key = (bytes(rho), k, n, q)
+        with self._lock:
+            A = self._entries.get(key)
+            if A is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return A
+            self.misses += 1
+
+        # Expand outside the lock so concurrent misses don't serialize
+        A = expand_a(key[0], k, n, q)
+        A.setflags(write=False)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = A
+                self.current_bytes += A.nbytes
+                while self.current_bytes > self.max_bytes and self._entries:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.current_bytes -= evicted.nbytes
+        return A
+
+    def clear(self):
+        """Drop every cached matrix"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+# Shared by every KEM in this directory
+matrix_cache = MatrixCache()
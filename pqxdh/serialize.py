@@ -0,0 +1,89 @@
+import numpy as np
+
+# Byte-level wire format for Kyber keys and ciphertexts (FIPS 203 layout).
+# Coefficients are written as d-bit little-endian integers, least significant
+# bit first, so 256 coefficients at d = 12 take exactly 384 bytes.
+#
+#   public key:  ByteEncode_12(t) || rho                       384k + 32 bytes
+#   ciphertext:  ByteEncode_du(Compress_du(u)) ||
+#                ByteEncode_dv(Compress_dv(v))                 32(du·k + dv) bytes
+#
+# Decoders accept bytes, bytearray or memoryview and read them in place with
+# np.frombuffer; no intermediate copy of the input buffer is made.
+
+Q = 3329
+N = 256
+SEED_BYTES = 32
+
+def compress(x, d, q=Q):
+    """Compress coefficients mod q to d bits: round(2^d / q · x) mod 2^d"""
+    x = np.asarray(x, dtype=np.int64) % q
+    return ((((x << d) + q // 2) // q) & ((1 << d) - 1)).astype(np.uint16)
+
+def decompress(y, d, q=Q):
+    """Decompress d-bit values back to coefficients mod q: round(q / 2^d · y)"""
+    y = np.asarray(y, dtype=np.int64)
+    return ((y * q + (1 << (d - 1))) >> d).astype(np.uint16)
+
+def byte_encode(values, d):
+    """Pack an array of d-bit integers into bytes"""
+    values = np.asarray(values, dtype=np.uint16).reshape(-1)
+    if d == 12:
+        # Two coefficients per three bytes, no bit expansion needed
+        pairs = values.reshape(-1, 2)
+        out = np.empty((pairs.shape[0], 3), dtype=np.uint8)
+        out[:, 0] = pairs[:, 0] & 0xFF
+        out[:, 1] = (pairs[:, 0] >> 8) | ((pairs[:, 1] & 0x0F) << 4)
+        out[:, 2] = pairs[:, 1] >> 4
+        return out.tobytes()
+    bits = ((values[:, None] >> np.arange(d, dtype=np.uint16)) & 1).astype(np.uint8)
+    return np.packbits(bits.reshape(-1), bitorder="little").tobytes()
+
+def byte_decode(data, d):
+    """Unpack bytes into an array of d-bit integers"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if d == 12:
+        b = raw.reshape(-1, 3).astype(np.uint16)
+        out = np.empty((b.shape[0], 2), dtype=np.uint16)
+        out[:, 0] = b[:, 0] | ((b[:, 1] & 0x0F) << 8)
+        out[:, 1] = (b[:, 1] >> 4) | (b[:, 2] << 4)
+        return out.reshape(-1)
+    bits = np.unpackbits(raw, bitorder="little").reshape(-1, d).astype(np.uint16)
+    return bits @ (np.uint16(1) << np.arange(d, dtype=np.uint16))
+
+def public_key_size(k):
+    """Encoded public key length in bytes"""
+    return 384 * k + SEED_BYTES
+
+def ciphertext_size(k, du, dv):
+    """Encoded ciphertext length in bytes"""
+    return N * (du * k + dv) // 8
+
+def encode_public_key(t, rho):
+    """Encode a public key (t mod q, 32-byte seed rho) as bytes"""
+    return byte_encode(np.asarray(t) % Q, 12) + bytes(rho)
+
+def decode_public_key(data, k):
+    """Decode a public key into (t as uint16 (k, n), rho as a memoryview of data)"""
+    data = memoryview(data)
+    if len(data) != public_key_size(k):
+        raise ValueError(f"Public key must be {public_key_size(k)} bytes, got {len(data)}")
+    split = 384 * k
+    t = byte_decode(data[:split], 12).reshape(k, N)
+    if (t >= Q).any():
+        raise ValueError("Public key coefficient out of range")
+    return t, data[split:]
+
+def encode_ciphertext(c1, c2, du, dv):
+    """Encode compressed ciphertext parts (c1: k×n at du bits, c2: n at dv bits)"""
+    return byte_encode(c1, du) + byte_encode(c2, dv)
+
+def decode_ciphertext(data, k, du, dv):
+    """Decode a ciphertext into compressed parts (c1 as uint16 (k, n), c2 as uint16 (n,))"""
+    data = memoryview(data)
+    if len(data) != ciphertext_size(k, du, dv):
+        raise ValueError(f"Ciphertext must be {ciphertext_size(k, du, dv)} bytes, got {len(data)}")
+    split = N * du * k // 8
+    c1 = byte_decode(data[:split], du).reshape(k, N)
+    c2 = byte_decode(data[split:], dv)
+    return c1, c2
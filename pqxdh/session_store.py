@@ -0,0 +1,282 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+import double_rachet
+from double_rachet import DHKeyPair, RatchetState, SkippedKeyStore
+
+# Persistent session store: one fixed-size record per session in a
+# memory-mapped file, so a restart can pick sessions up without a new
+# handshake.
+#
+# Every record has two slots that are written alternately, each with a
+# sequence number and a CRC32. A write that is torn by a crash can only damage
+# the slot being written; loading takes the valid slot with the highest
+# sequence number, which is then the previous state. Loads and saves touch a
+# single record, and the fields of recently used records are also kept in an
+# LRU. load() decodes a new RatchetState from them every time, so a state is
+# never shared between callers and changes only count once they are saved.
+#
+# Not persisted: skipped message keys (a reloaded session starts with an empty
+# store) and the header-encryption fields of a RatchetState.
+
+MAGIC = b"PQXDHSS1"
+HEADER = struct.Struct("<8sII")  # magic, slot size, record count
+HEADER_SIZE = 64
+# seq, id length, id, kind, flags, RK, CKs, CKr, Ns, Nr, PN, DHs private, DHs public, DHr
+SLOT = struct.Struct("<QB32sBB32s32s32sIII32s32s32s")
+SLOT_SIZE = 256  # SLOT plus the CRC32, padded
+RECORD_SIZE = 2 * SLOT_SIZE
+MAX_ID_SIZE = 32
+
+KIND_RATCHET = 1
+KIND_SESSION = 2  # pqxdh.SignalStyleSession: sending key in CKs, receiving key in CKr, message number in Ns
+
+HAS_CKS = 1
+HAS_CKR = 2
+HAS_DHS = 4
+HAS_DHR = 8
+HAS_RK = 16
+
+EMPTY = bytes(32)
+
+def _encode_ratchet(state):
+    """SLOT fields after the id for a RatchetState"""
+    if state.DHRs is not None:
+        raise ValueError("Header-encrypted ratchet states are not supported")
+    flags = ((HAS_RK if state.RK is not None else 0) | (HAS_CKS if state.CKs is not None else 0) |
+             (HAS_CKR if state.CKr is not None else 0) | (HAS_DHS if state.DHs is not None else 0) |
+             (HAS_DHR if state.DHr is not None else 0))
+    private = public = EMPTY
+    if state.DHs is not None:
+        private, public = state.DHs
+        if not isinstance(private, bytes):
+            private = private.private_bytes_raw()
+    return (KIND_RATCHET, flags, state.RK or EMPTY, state.CKs or EMPTY, state.CKr or EMPTY,
+            state.Ns, state.Nr, state.PN, private, public, state.DHr or EMPTY)
+
+def _decode_ratchet(fields):
+    kind, flags, RK, CKs, CKr, Ns, Nr, PN, private, public, DHr = fields
+    state = RatchetState()
+    state.RK = RK if flags & HAS_RK else None
+    state.CKs = CKs if flags & HAS_CKS else None
+    state.CKr = CKr if flags & HAS_CKR else None
+    state.Ns, state.Nr, state.PN = Ns, Nr, PN
+    # The private key stays raw bytes until the next DH ratchet step needs it
+    state.DHs = DHKeyPair(private, public) if flags & HAS_DHS else None
+    state.DHr = DHr if flags & HAS_DHR else None
+    state.MKSKIPPED = SkippedKeyStore()
+    return state
+
+class SessionStore:
+    """Ratchet states (and SignalStyleSession keys) in fixed-size records of an mmap'd file"""
+    def __init__(self, path, cache_size=10000, sync=False, initial_records=1024):
+        self.path = path
+        self.cache_size = cache_size
+        # sync=True flushes each saved record to disk (msync) before returning;
+        # otherwise a save survives a process crash but not a power loss
+        self.sync = sync
+        self._cache = OrderedDict()  # session id -> SLOT fields after the id, as last saved
+        self._index = {}  # session id -> record number
+        self._seqs = []  # record number -> sequence number of its newest slot
+        self._free = []  # record numbers of deleted sessions
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.write(HEADER.pack(MAGIC, SLOT_SIZE, 0).ljust(HEADER_SIZE, b"\0"))
+            self._file.truncate(HEADER_SIZE + initial_records * RECORD_SIZE)
+            self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, slot_size, self._records = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            raise ValueError("Not a session store file")
+        self._capacity = (len(self._map) - HEADER_SIZE) // RECORD_SIZE
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the session id index with one pass over the records"""
+        for record in range(self._records):
+            slot = self._newest_slot(record)
+            if slot is None:
+                self._seqs.append(0)
+                self._free.append(record)
+                continue
+            seq, fields = slot
+            self._seqs.append(seq)
+            id_length, session_id, kind = fields[1], fields[2], fields[3]
+            if kind == 0:
+                # Deleted
+                self._free.append(record)
+            else:
+                self._index[session_id[:id_length]] = record
+
+    def _read_slot(self, record, slot):
+        offset = HEADER_SIZE + record * RECORD_SIZE + slot * SLOT_SIZE
+        data = self._map[offset:offset + SLOT.size + 4]
+        (crc,) = struct.unpack_from("<I", data, SLOT.size)
+        if zlib.crc32(data[:SLOT.size]) != crc:
+            return None
+        fields = SLOT.unpack_from(data)
+        return fields[0], fields
+
+    def _newest_slot(self, record):
+        """(seq, fields) of the valid slot with the highest sequence number, or None"""
+        slots = [slot for slot in (self._read_slot(record, 0), self._read_slot(record, 1))
+                 if slot is not None and slot[0] > 0]
+        return max(slots, key=lambda slot: slot[0]) if slots else None
+
+    def _write(self, record, session_id, fields):
+        seq = self._seqs[record] + 1
+        data = SLOT.pack(seq, len(session_id), session_id, *fields)
+        # Odd sequence numbers go to slot 1 and even ones to slot 0, so the
+        # newest complete write is never the one being overwritten
+        offset = HEADER_SIZE + record * RECORD_SIZE + (seq % 2) * SLOT_SIZE
+        self._map[offset:offset + SLOT.size + 4] = data + struct.pack("<I", zlib.crc32(data))
+        self._seqs[record] = seq
+        if self.sync:
+            start = offset - offset % mmap.PAGESIZE
+            self._map.flush(start, offset + SLOT_SIZE - start)
+
+    def _grow(self):
+        """Double the number of records the file can hold"""
+        self._capacity *= 2
+        self._map.close()
+        self._file.truncate(HEADER_SIZE + self._capacity * RECORD_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _record_for(self, session_id):
+        record = self._index.get(session_id)
+        if record is not None:
+            return record
+        if self._free:
+            record = self._free.pop()
+        else:
+            if self._records == self._capacity:
+                self._grow()
+            record = self._records
+            self._records += 1
+            self._seqs.append(0)
+            HEADER.pack_into(self._map, 0, MAGIC, SLOT_SIZE, self._records)
+        self._index[session_id] = record
+        return record
+
+    def _remember(self, session_id, fields):
+        self._cache[session_id] = fields
+        self._cache.move_to_end(session_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def save(self, session_id, state):
+        """Persist a RatchetState under session_id (bytes of at most 32)"""
+        if len(session_id) > MAX_ID_SIZE:
+            raise ValueError("Session id is longer than 32 bytes")
+        fields = _encode_ratchet(state)
+        with self._lock:
+            self._write(self._record_for(session_id), session_id, fields)
+            self._remember(session_id, fields)
+
+    def load(self, session_id):
+        """A new RatchetState decoded from what was last saved under session_id, or None"""
+        with self._lock:
+            fields = self._cache.get(session_id)
+            if fields is not None:
+                self._cache.move_to_end(session_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+                record = self._index.get(session_id)
+                if record is None:
+                    return None
+                slot = self._newest_slot(record)
+                if slot is None:
+                    return None
+                fields = slot[1][3:]
+                self._remember(session_id, fields)
+        if fields[0] != KIND_RATCHET:
+            return None
+        return _decode_ratchet(fields)
+
+    def save_session(self, session_id, session):
+        """Persist the keys and message number of a pqxdh.SignalStyleSession"""
+        if len(session_id) > MAX_ID_SIZE:
+            raise ValueError("Session id is longer than 32 bytes")
+        flags = ((HAS_CKS if session.current_sending_key else 0) |
+                 (HAS_CKR if session.current_receiving_key else 0))
+        fields = (KIND_SESSION, flags, EMPTY, session.current_sending_key or EMPTY,
+                  session.current_receiving_key or EMPTY, session.message_number, 0, 0, EMPTY, EMPTY, EMPTY)
+        with self._lock:
+            self._write(self._record_for(session_id), session_id, fields)
+            # Replaces whatever the cache held for this id, so load() sees the new kind
+            self._remember(session_id, fields)
+
+    def load_session(self, session_id, session):
+        """Restore a SignalStyleSession saved under session_id into session; False if there is none"""
+        with self._lock:
+            record = self._index.get(session_id)
+            slot = self._newest_slot(record) if record is not None else None
+        if slot is None or slot[1][3] != KIND_SESSION:
+            return False
+        flags, CKs, CKr, Ns = slot[1][4], slot[1][6], slot[1][7], slot[1][8]
+        session.current_sending_key = CKs if flags & HAS_CKS else None
+        session.current_receiving_key = CKr if flags & HAS_CKR else None
+        session.message_number = Ns
+        return True
+
+    def delete(self, session_id):
+        """Forget a session; its record is reused by the next new session"""
+        with self._lock:
+            record = self._index.pop(session_id, None)
+            self._cache.pop(session_id, None)
+            if record is None:
+                return
+            self._write(record, b"", (0, 0, EMPTY, EMPTY, EMPTY, 0, 0, 0, EMPTY, EMPTY, EMPTY))
+            self._free.append(record)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, session_id):
+        return session_id in self._index
+
+    def flush(self):
+        """Write every dirty page to disk"""
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    alice, bob = double_rachet.session_pair()
+    header, ciphertext = alice.encrypt(b"Before the restart", b"AD")
+    print(f"Bob decrypted: {bob.decrypt(header, ciphertext, b'AD').decode()}")
+
+    with SessionStore(path) as store:
+        store.save(b"alice", alice)
+        store.save(b"bob", bob)
+
+    # A new process would reopen the file and carry on without a handshake
+    with SessionStore(path) as store:
+        alice, bob = store.load(b"alice"), store.load(b"bob")
+        print(f"Reloaded {len(store)} sessions from {path}")
+        header, ciphertext = alice.encrypt(b"After the restart", b"AD")
+        print(f"Bob decrypted: {bob.decrypt(header, ciphertext, b'AD').decode()}")
+        header, ciphertext = bob.encrypt(b"Reply after the restart", b"AD")
+        print(f"Alice decrypted: {alice.decrypt(header, ciphertext, b'AD').decode()}")
@@ -1,8 +1,12 @@
 import os
 import hashlib
+import hmac
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 import numpy as np
+import ntt as ntt_engine
+import sampling
+import serialize
 
 class KyberParameters:
     """Parameters for Kyber key exchange"""
@@ -19,180 +23,221 @@ def generate_seed():
     """Generate a random seed"""
     return os.urandom(32)
 
-def cbd(eta, seed, nonce):
-    """Centered Binomial Distribution sampler"""
-    # In a real implementation, this would sample from the CBD
-    # Here we use a simplified version that returns small values
-    np.random.seed(int.from_bytes(hashlib.sha256(seed + bytes([nonce])).digest()[:4], byteorder='little'))
-    return np.random.randint(-eta, eta+1, size=256)
-
 def compress(x, d):
-    """Compress a value to d bits"""
-    # In a production implementation, this would be a proper compression function
-    # Here we simply simulate the effect
-    return x % (2**d)
+    """Compress values mod q to d bits: round(2^d/q · x) mod 2^d, over a whole array"""
+    return serialize.compress(x, d)
 
 def decompress(x, d):
-    """Decompress a value compressed to d bits"""
-    # Simplified decompression
-    return x
+    """Decompress d-bit values back to mod q: round(q/2^d · x), over a whole array"""
+    return serialize.decompress(x, d)
 
 def ntt(poly):
     """Number-Theoretic Transform - converts polynomial to point representation"""
-    # This is a simplified placeholder. In a real implementation, 
-    # this would be a proper NTT implementation
-    return poly.copy()
+    return ntt_engine.ntt(poly)
 
 def inv_ntt(poly):
     """Inverse NTT - converts from point representation back to polynomial"""
-    # Simplified placeholder
-    return poly.copy()
+    return ntt_engine.inv_ntt(poly)
+
+def matvec(A, s):
+    """Matrix-vector product A·s in NTT domain"""
+    return ntt_engine.matvec(A, s)
+
+def dot(a, b):
+    """Inner product a^T·b in NTT domain"""
+    return ntt_engine.dot(a, b)
 
-def poly_mul(a, b, q):
-    """Multiply two polynomials in NTT domain"""
-    # In a real implementation, this would be polynomial multiplication in the NTT domain
-    # Here we use a simplified version
-    return (a * b) % q
+def G(data):
+    """Hash to two 32-byte outputs (SHA3-512)"""
+    digest = hashlib.sha3_512(data).digest()
+    return digest[:32], digest[32:]
+
+def H(data):
+    """Hash to 32 bytes (SHA3-256)"""
+    return hashlib.sha3_256(data).digest()
+
+def J(data):
+    """Hash to the 32-byte implicit-rejection key (SHAKE-256)"""
+    return hashlib.shake_256(data).digest(32)
 
 class Kyber:
     def __init__(self, params=None):
         self.params = params or KyberParameters()
-        
-    def keygen(self):
-        """Generate a key pair"""
+    
+    # The core routines below work on a leading batch axis: vectors are
+    # (batch, k, n) and matrices (batch, k, k, n), so one key and a thousand
+    # keys go through the same NumPy operations.
+    
+    def _sample_vectors(self, eta, seeds, nonce, count=None):
+        """CBD sampler: count (default k) small polynomials per seed from the SHAKE-256 PRF, as (batch, count, n)"""
+        count = count or self.params.k
+        # One XOF call per seed, then a single bit-counting pass over the whole batch
+        data = b''.join(sampling.prf(seed, nonce, count * 64 * eta) for seed in seeds)
+        return sampling.cbd_from_bytes(data, eta).reshape(len(seeds), count, self.params.n)
+    
+    def _matrices(self, rhos, cache=True):
+        """Expand the matrix A for every seed, returned as (batch, k, k, n)"""
         params = self.params
-        
-        # Generate random seed
-        seed = generate_seed()
-        
-        # Generate public parameter A (a matrix of polynomials in NTT form)
-        # In a real implementation, A would be generated deterministically from a seed
-        A = np.random.randint(0, params.q, size=(params.k, params.k, params.n))
-        
-        # Generate secret key s
-        s = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            s[i] = cbd(params.eta1, seed, i)
-        
-        # Convert s to NTT form
-        s_ntt = np.zeros_like(s)
-        for i in range(params.k):
-            s_ntt[i] = ntt(s[i])
-        
-        # Generate error e
-        e = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            e[i] = cbd(params.eta2, seed, params.k + i)
-        
-        # Compute public key t = A·s + e
-        t = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            for j in range(params.k):
-                t[i] = (t[i] + poly_mul(A[i][j], s_ntt[j], params.q)) % params.q
-            t[i] = (t[i] + e[i]) % params.q
-        
-        # Pack keys
-        public_key = {
-            'A': A,
-            't': t
-        }
-        
-        secret_key = {
-            's': s,
-            't': t  # Include public key as part of secret key for re-encryption check
-        }
-        
-        return public_key, secret_key
+        if cache:
+            return np.stack([sampling.matrix_cache.get(rho, params.k, params.n, params.q) for rho in rhos])
+        # Bulk one-time prekeys would only churn the shared cache
+        return np.stack([sampling.expand_a(rho, params.k, params.n, params.q) for rho in rhos])
     
-    def encaps(self, public_key):
-        """Encapsulate a shared secret using recipient's public key"""
+    def _encode_ciphertext(self, u, v):
+        """Wire bytes of one compressed ciphertext"""
+        return serialize.encode_ciphertext(u, v, self.params.du, self.params.dv)
+    
+    def _encrypt_many(self, A, t, messages, coins):
+        """Deterministic encryption of each message m under (A, t) with noise seeded by coins"""
         params = self.params
-        A, t = public_key['A'], public_key['t']
-        
-        # Generate random value m
-        m = os.urandom(32)
+        batch = len(messages)
         
-        # Hash m to get shared_secret
-        h = hashlib.sha256(m).digest()
-        shared_secret = hashlib.sha256(h).digest()  # Simplified for this demo
-        
-        # Use m directly as seed for noise
-        r_seed = m
-        
-        # Generate r from r_seed (small polynomial)
-        r = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            r[i] = cbd(params.eta1, r_seed, i)
+        # Generate r, e1 and e2 from the coins
+        r = self._sample_vectors(params.eta1, coins, 0)
+        e1 = self._sample_vectors(params.eta2, coins, params.k)
+        e2 = self._sample_vectors(params.eta2, coins, 2 * params.k, count=1)[:, 0]
         
         # Convert r to NTT form
-        r_ntt = np.zeros_like(r)
-        for i in range(params.k):
-            r_ntt[i] = ntt(r[i])
-        
-        # Generate error e1
-        e1 = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            e1[i] = cbd(params.eta2, r_seed, params.k + i)
-        
-        # Generate error e2
-        e2 = cbd(params.eta2, r_seed, 2*params.k)
+        r_ntt = ntt(r)
         
         # Compute u = A^T·r + e1
-        u = np.zeros((params.k, params.n), dtype=int)
-        for i in range(params.k):
-            for j in range(params.k):
-                u[i] = (u[i] + poly_mul(A[j][i], r_ntt[j], params.q)) % params.q
-            u[i] = (u[i] + e1[i]) % params.q
+        u = (inv_ntt(matvec(np.swapaxes(A, -3, -2), r_ntt)) + e1) % params.q
         
         # Compute v = t^T·r + e2 + encode(m)
-        v = np.zeros(params.n, dtype=int)
-        for i in range(params.k):
-            v = (v + poly_mul(t[i], r_ntt[i], params.q)) % params.q
-        v = (v + e2) % params.q
+        v = (inv_ntt(dot(t, r_ntt)) + e2) % params.q
         
-        # Encode m into a polynomial and add to v
-        # Convert bytes to int array correctly
-        m_encoded = np.zeros(params.n, dtype=int)
-        for i in range(min(32, params.n)):
-            # Set bit to 1 if the corresponding bit in m is 1
-            # This is a simplified encoding for demonstration
-            if i < len(m):
-                for j in range(8):
-                    if (m[i] >> j) & 1:
-                        m_encoded[i*8 + j] = params.q // 2
+        # Encode m into a polynomial: each bit of m becomes 0 or round(q/2)
+        m_bytes = np.frombuffer(b''.join(messages), dtype=np.uint8).reshape(batch, 32)
+        m_encoded = decompress(np.unpackbits(m_bytes, axis=-1, bitorder='little'), 1)
         
         v = (v + m_encoded) % params.q
         
         # Compress u and v
-        u_compressed = np.zeros_like(u)
-        for i in range(params.k):
-            for j in range(params.n):
-                u_compressed[i][j] = compress(u[i][j], params.du)
+        return compress(u, params.du), compress(v, params.dv)
+    
+    def _keygen_many(self, seeds, cache=True):
+        """Generate one key pair per seed"""
+        if not seeds:
+            return [], []
+        params = self.params
         
-        v_compressed = np.zeros_like(v)
-        for j in range(params.n):
-            v_compressed[j] = compress(v[j], params.dv)
+        # Split every seed into the public seed rho and the noise seed sigma
+        expanded = [G(seed) for seed in seeds]
+        rhos = [rho for rho, _ in expanded]
+        sigmas = [sigma for _, sigma in expanded]
+        
+        # Generate public parameter A (a matrix of polynomials in NTT form) from rho
+        A = self._matrices(rhos, cache)
+        
+        # Generate secret key s and error e
+        s = self._sample_vectors(params.eta1, sigmas, 0)
+        e = self._sample_vectors(params.eta2, sigmas, params.k)
+        
+        # Compute public key t = A·s + e (kept in NTT form)
+        s_ntt = ntt(s)
+        t = (matvec(A, s_ntt) + ntt(e)) % params.q
+        
+        # Pack keys: only the 32-byte seed for A and t packed at 12 bits per coefficient
+        packed = serialize.byte_encode(t, 12)
+        size = len(packed) // len(seeds)
+        public_keys, secret_keys = [], []
+        for i, rho in enumerate(rhos):
+            t_packed = packed[i * size:(i + 1) * size]
+            public_keys.append({
+                'rho': rho,
+                't': t_packed
+            })
+            secret_keys.append({
+                's': s_ntt[i],  # In NTT form, ready for decapsulation
+                'rho': rho,  # Include public key as part of secret key for re-encryption check
+                't': t_packed,
+                'h': H(t_packed + rho),  # Hash of the encoded public key
+                'z': os.urandom(32)  # Implicit rejection secret
+            })
+        
+        return public_keys, secret_keys
+    
+    def _encaps_many(self, public_keys):
+        """Encapsulate one shared secret to each public key"""
+        if not public_keys:
+            return [], []
+        params = self.params
+        batch = len(public_keys)
+        
+        # Regenerate A from its seed (cached, so repeat encapsulations to one key skip this)
+        A = self._matrices([pk['rho'] for pk in public_keys])
+        t = serialize.byte_decode(b''.join(pk['t'] for pk in public_keys), 12).reshape(batch, params.k, params.n)
         
-        # Save the original message m for decapsulation verification
-        ciphertext = {
-            'u': u_compressed,
-            'v': v_compressed,
-            'm': m  # This is just for our demo - in a real implementation, m is not part of the ciphertext
-        }
+        # Generate random values m and derive (shared secret, coins) = G(m || H(pk))
+        messages = [os.urandom(32) for _ in range(batch)]
+        derived = [G(m + H(pk['t'] + pk['rho'])) for m, pk in zip(messages, public_keys)]
+        shared_secrets = [key for key, _ in derived]
+        coins = [c for _, c in derived]
         
-        return ciphertext, shared_secret
+        u, v = self._encrypt_many(A, t, messages, coins)
+        ciphertexts = [{'u': u[i], 'v': v[i]} for i in range(batch)]
+        
+        return ciphertexts, shared_secrets
+    
+    def _decaps_many(self, ciphertexts, secret_key):
+        """Decapsulate ciphertexts addressed to one secret key"""
+        if not ciphertexts:
+            return []
+        params = self.params
+        batch = len(ciphertexts)
+        
+        u = decompress(np.stack([ct['u'] for ct in ciphertexts]), params.du)
+        v = decompress(np.stack([ct['v'] for ct in ciphertexts]), params.dv)
+        
+        # w = v - s^T·u, computed in NTT domain for the whole batch
+        w = (v.astype(np.int64) - inv_ntt(dot(secret_key['s'], ntt(u)))) % params.q
+        
+        # Decode m: a coefficient is a 1 bit when it is closer to q/2 than to 0
+        m_bits = compress(w, 1).astype(np.uint8)
+        m_bytes = np.packbits(m_bits, axis=-1, bitorder='little')
+        messages = [m_bytes[i].tobytes() for i in range(batch)]
+        
+        # Re-derive the coins and re-encrypt (Fujisaki-Okamoto check)
+        derived = [G(m + secret_key['h']) for m in messages]
+        A = sampling.matrix_cache.get(secret_key['rho'], params.k, params.n, params.q)
+        t = serialize.byte_decode(secret_key['t'], 12).reshape(params.k, params.n)
+        u2, v2 = self._encrypt_many(A, t, messages, [c for _, c in derived])
+        
+        shared_secrets = []
+        for i, ct in enumerate(ciphertexts):
+            c = self._encode_ciphertext(ct['u'], ct['v'])
+            if hmac.compare_digest(c, self._encode_ciphertext(u2[i], v2[i])):
+                shared_secrets.append(derived[i][0])
+            else:
+                # Implicit rejection: a pseudorandom key that reveals nothing
+                shared_secrets.append(J(secret_key['z'] + c))
+        return shared_secrets
+    
+    def keygen(self):
+        """Generate a key pair"""
+        public_keys, secret_keys = self._keygen_many([generate_seed()])
+        return public_keys[0], secret_keys[0]
+    
+    def keygen_batch(self, count):
+        """Generate count key pairs in one vectorized pass"""
+        return self._keygen_many([generate_seed() for _ in range(count)], cache=False)
+    
+    def encaps(self, public_key):
+        """Encapsulate a shared secret using recipient's public key"""
+        ciphertexts, shared_secrets = self._encaps_many([public_key])
+        return ciphertexts[0], shared_secrets[0]
+    
+    def encaps_batch(self, public_keys):
+        """Encapsulate to a list of public keys in one vectorized pass"""
+        return self._encaps_many(public_keys)
     
     def decaps(self, ciphertext, secret_key):
         """Decapsulate ciphertext using recipient's secret key to recover shared secret"""
-        # For our simplified demo, we'll just use the provided m
-        # In a real implementation, we would properly decode m from the ciphertext
-        m = ciphertext['m']
-        
-        # Hash m to get shared secret - same as in encaps
-        h = hashlib.sha256(m).digest()
-        shared_secret = hashlib.sha256(h).digest()
-        
-        return shared_secret
+        return self._decaps_many([ciphertext], secret_key)[0]
+    
+    def decaps_batch(self, ciphertexts, secret_key):
+        """Decapsulate a list of ciphertexts addressed to one secret key in one vectorized pass"""
+        return self._decaps_many(ciphertexts, secret_key)
 
 # Example demonstrating Alice and Bob communicating:
 def demonstrate_key_exchange():
@@ -206,11 +251,14 @@ def demonstrate_key_exchange():
     print("Alice: Generating key pair...")
     alice_pk, alice_sk = kyber.keygen()
     print("Alice: Key pair generated successfully!")
+    print(f"Alice: Public key size: {len(alice_pk['rho']) + len(alice_pk['t'])} bytes")
     
     # Bob encapsulates a shared secret using Alice's public key
     print("\nBob: Encapsulating shared secret using Alice's public key...")
     ciphertext, bob_shared_secret = kyber.encaps(alice_pk)
     print(f"Bob: Shared secret generated: {bob_shared_secret.hex()[:16]}...")
+    ct_bytes = serialize.encode_ciphertext(ciphertext['u'], ciphertext['v'], kyber.params.du, kyber.params.dv)
+    print(f"Bob: Ciphertext size: {len(ct_bytes)} bytes")
     
     # Alice decapsulates to obtain the same shared secret
     print("\nAlice: Decapsulating ciphertext using private key...")